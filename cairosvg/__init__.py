@@ -3,7 +3,9 @@ CairoSVG - A simple SVG converter based on Cairo.
 
 """
 
+import json
 import sys
+from itertools import count
 from pathlib import Path
 
 if hasattr(sys, 'frozen'):
@@ -23,6 +25,8 @@ VERSION = __version__ = (ROOT / 'VERSION').read_text().strip()
 
 # VERSION is used in the "url" module imported by "surface"
 from . import surface  # noqa isort:skip
+from . import parser  # noqa isort:skip
+from . import css, path  # noqa isort:skip
 
 
 SURFACES = {
@@ -37,62 +41,155 @@ SURFACES = {
 def svg2svg(bytestring=None, *, file_obj=None, url=None, dpi=96,
             parent_width=None, parent_height=None, scale=1, unsafe=False,
             background_color=None, negate_colors=False, invert_images=False,
-            write_to=None, output_width=None, output_height=None):
+            write_to=None, output_width=None, output_height=None,
+            document_cache=None, simplify_tolerance=None,
+            tolerance=None, spatial_index=False):
     return surface.SVGSurface.convert(
         bytestring=bytestring, file_obj=file_obj, url=url, dpi=dpi,
         parent_width=parent_width, parent_height=parent_height, scale=scale,
         background_color=background_color,
         negate_colors=negate_colors, invert_images=invert_images,
         unsafe=unsafe, write_to=write_to, output_width=output_width,
-        output_height=output_height)
+        output_height=output_height, document_cache=document_cache,
+        simplify_tolerance=simplify_tolerance, tolerance=tolerance,
+        spatial_index=spatial_index)
 
 
 def svg2png(bytestring=None, *, file_obj=None, url=None, dpi=96,
             parent_width=None, parent_height=None, scale=1, unsafe=False,
             background_color=None, negate_colors=False, invert_images=False,
-            write_to=None, output_width=None, output_height=None):
+            write_to=None, output_width=None, output_height=None,
+            document_cache=None, simplify_tolerance=None,
+            tolerance=None, spatial_index=False):
     return surface.PNGSurface.convert(
         bytestring=bytestring, file_obj=file_obj, url=url, dpi=dpi,
         parent_width=parent_width, parent_height=parent_height, scale=scale,
         background_color=background_color, negate_colors=negate_colors,
         invert_images=invert_images, unsafe=unsafe, write_to=write_to,
-        output_width=output_width, output_height=output_height)
+        output_width=output_width, output_height=output_height,
+        document_cache=document_cache,
+        simplify_tolerance=simplify_tolerance, tolerance=tolerance,
+        spatial_index=spatial_index)
 
 
 def svg2pdf(bytestring=None, *, file_obj=None, url=None, dpi=96,
             parent_width=None, parent_height=None, scale=1, unsafe=False,
             background_color=None, negate_colors=False, invert_images=False,
-            write_to=None, output_width=None, output_height=None):
+            write_to=None, output_width=None, output_height=None,
+            document_cache=None, simplify_tolerance=None,
+            tolerance=None, spatial_index=False):
     return surface.PDFSurface.convert(
         bytestring=bytestring, file_obj=file_obj, url=url, dpi=dpi,
         parent_width=parent_width, parent_height=parent_height, scale=scale,
         background_color=background_color, negate_colors=negate_colors,
         invert_images=invert_images, unsafe=unsafe, write_to=write_to,
-        output_width=output_width, output_height=output_height)
+        output_width=output_width, output_height=output_height,
+        document_cache=document_cache,
+        simplify_tolerance=simplify_tolerance, tolerance=tolerance,
+        spatial_index=spatial_index)
 
 
 def svg2ps(bytestring=None, *, file_obj=None, url=None, dpi=96,
            parent_width=None, parent_height=None, scale=1, unsafe=False,
            background_color=None, negate_colors=False, invert_images=False,
-           write_to=None, output_width=None, output_height=None):
+           write_to=None, output_width=None, output_height=None,
+           document_cache=None, simplify_tolerance=None,
+           tolerance=None, spatial_index=False):
     return surface.PSSurface.convert(
         bytestring=bytestring, file_obj=file_obj, url=url, dpi=dpi,
         parent_width=parent_width, parent_height=parent_height, scale=scale,
         background_color=background_color, negate_colors=negate_colors,
         invert_images=invert_images, unsafe=unsafe, write_to=write_to,
-        output_width=output_width, output_height=output_height)
+        output_width=output_width, output_height=output_height,
+        document_cache=document_cache,
+        simplify_tolerance=simplify_tolerance, tolerance=tolerance,
+        spatial_index=spatial_index)
 
 
 def svg2eps(bytestring=None, *, file_obj=None, url=None, dpi=96,
             parent_width=None, parent_height=None, scale=1, unsafe=False,
             background_color=None, negate_colors=False, invert_images=False,
-            write_to=None, output_width=None, output_height=None):
+            write_to=None, output_width=None, output_height=None,
+            document_cache=None, simplify_tolerance=None,
+            tolerance=None, spatial_index=False):
     return surface.EPSSurface.convert(
         bytestring=bytestring, file_obj=file_obj, url=url, dpi=dpi,
         parent_width=parent_width, parent_height=parent_height, scale=scale,
         background_color=background_color, negate_colors=negate_colors,
         invert_images=invert_images, unsafe=unsafe, write_to=write_to,
-        output_width=output_width, output_height=output_height)
+        output_width=output_width, output_height=output_height,
+        document_cache=document_cache,
+        simplify_tolerance=simplify_tolerance, tolerance=tolerance,
+        spatial_index=spatial_index)
+
+
+def convert_many(bytestring=None, *, file_obj=None, url=None, unsafe=False,
+                 outputs=()):
+    """Convert an SVG document to multiple outputs, parsing it only once.
+
+    Specify the input with ``bytestring``, ``file_obj`` or ``url``, and allow
+    external file access with ``unsafe``, as for :func:`svg2png`.
+
+    ``outputs`` is a list of dicts, or a dict of dicts, giving the ``format``
+    of each output (``'png'``, ``'pdf'``, ``'ps'``, ``'eps'`` or ``'svg'``)
+    and the other parameters accepted by :func:`svg2png` to draw it, such as
+    ``scale``, ``output_width`` or ``write_to``.
+
+    Return a dict whose keys are the indexes or the keys of ``outputs``, and
+    whose values are the outputs as byte strings, or ``None`` for the outputs
+    written to ``write_to``.
+
+    """
+    tree = parser.Tree(
+        bytestring=bytestring, file_obj=file_obj, url=url, unsafe=unsafe)
+    surface.prepare_tree(tree)
+    items = outputs.items() if isinstance(outputs, dict) else (
+        enumerate(outputs))
+    results = {}
+    for key, options in items:
+        options = dict(options)
+        surface_class = SURFACES[options.pop('format').upper()]
+        results[key] = surface_class.convert_tree(tree.clone(), **options)
+    return results
+
+
+def compile_document(**kwargs):
+    """Return the SVG document as a compiled byte-string.
+
+    CSS rules are applied to the elements of compiled documents, their path
+    data without units is parsed and their elements are indexed by id.
+    Compiled documents are loaded faster than SVG documents by
+    :class:`cairosvg.parser.Tree`, and can only be loaded by the version of
+    CairoSVG used to create them.
+
+    Parameters are the same as :class:`cairosvg.parser.Tree` parameters.
+
+    """
+    tree = parser.Tree(lazy=True, **kwargs)
+    indexes = count()
+    ids = {}
+
+    def serialize(element):
+        node = element.etree_element
+        index = next(indexes)
+        if node.get('id') is not None:
+            ids.setdefault(node.get('id'), index)
+        properties = css.cascade(element, tree.style)
+        properties.pop('style', None)
+        serialized = [
+            node.tag, properties, node.text, node.tail,
+            [serialize(child) for child in element.iter_children()]]
+        is_path = node.tag in ('path', '{http://www.w3.org/2000/svg}path')
+        string = properties.get('d')
+        if is_path and string and path.CACHEABLE_PATH_DATA.fullmatch(string):
+            data = path.parse_path(None, string)
+            serialized.append([data.commands, list(data.vertices)])
+        return serialized
+
+    document = json.dumps(
+        [serialize(tree.element), ids], separators=(',', ':'))
+    return parser.COMPILED_HEADER + VERSION.encode() + b'\n' + (
+        document.encode())
 
 
 if __debug__:
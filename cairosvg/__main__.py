@@ -7,7 +7,7 @@ import argparse
 import sys
 from pathlib import Path
 
-from . import SURFACES, VERSION
+from . import SURFACES, VERSION, compile_document
 
 
 def main(argv=None, stdout=None, stdin=None):
@@ -50,6 +50,12 @@ def main(argv=None, stdout=None, stdin=None):
     parser.add_argument(
         '--output-height', default=None, type=float,
         help='desired output height in pixels')
+    parser.add_argument(
+        '-t', '--tolerance', default=None, type=float,
+        help='maximum error when drawing curves, lower is smoother but slower')
+    parser.add_argument(
+        '-c', '--compile', action='store_true',
+        help='write a compiled document, that can be used as a faster input')
 
     parser.add_argument('-o', '--output', default='-', help='output filename')
 
@@ -61,7 +67,8 @@ def main(argv=None, stdout=None, stdin=None):
         'negate_colors': options.negate_colors,
         'invert_images': options.invert_images,
         'output_width': options.output_width,
-        'output_height': options.output_height}
+        'output_height': options.output_height,
+        'tolerance': options.tolerance}
     stdin = stdin or sys.stdin
     stdout = stdout or sys.stdout
     kwargs['write_to'] = (
@@ -70,6 +77,15 @@ def main(argv=None, stdout=None, stdin=None):
         kwargs['file_obj'] = stdin.buffer
     else:
         kwargs['url'] = options.input
+    if options.compile:
+        document = compile_document(
+            file_obj=kwargs.get('file_obj'), url=kwargs.get('url'),
+            unsafe=options.unsafe)
+        if options.output == '-':
+            kwargs['write_to'].write(document)
+        else:
+            Path(options.output).write_bytes(document)
+        return
     output_format = (
         options.format or
         Path(options.output).suffix.lstrip('.') or
@@ -5,12 +5,11 @@ A bounding box is a (minx, miny, width, height) tuple.
 
 """
 
-from math import (
-    acos, atan, copysign, cos, fmod, hypot, isinf, pi, radians, sin, sqrt, tan,
-    tau)
+from array import array
+from math import atan2, ceil, cos, isinf, pi, sin, sqrt, tau
 
 from .features import match_features
-from .helpers import PATH_LETTERS, normalize, point, size
+from .helpers import parse_points, size, transform
 from .parser import Tree
 from .url import parse_url
 
@@ -66,153 +65,51 @@ def bounding_box_line(surface, node):
 
 
 def bounding_box_polyline(surface, node):
-    """Get the bounding box of a ``polyline`` or ``polygon`` node."""
-    bounding_box = EMPTY_BOUNDING_BOX
-    points = []
-    normalized_points = normalize(node.get('points', ''))
-    while normalized_points:
-        x, y, normalized_points = point(surface, normalized_points)
-        points.append((x, y))
-    return extend_bounding_box(bounding_box, points)
+    """Get the bounding box of a ``polyline`` or ``polygon`` node.
 
+    The bounding box is stored in the node, as it's needed each time the node
+    is drawn.
 
-def bounding_box_path(surface, node):
-    """Get the bounding box of a ``path`` node."""
-    path_data = node.get('d', '')
+    """
+    bounding_box = getattr(node, 'points_bounding_box', None)
+    if bounding_box is None:
+        coordinates = parse_points(surface, node.get('points', ''))
+        length = len(coordinates) // 2 * 2
+        bounding_box = node.points_bounding_box = points_bounding_box(
+            coordinates[0:length:2], coordinates[1:length:2])
+    return bounding_box
 
-    # Normalize path data for correct parsing
-    for letter in PATH_LETTERS:
-        path_data = path_data.replace(letter, f' {letter} ')
-    path_data = normalize(path_data)
 
-    bounding_box = EMPTY_BOUNDING_BOX
-    previous_x = 0
-    previous_y = 0
-    letter = 'M'    # Move as default
-    while path_data:
-        path_data = path_data.strip()
-        if path_data.split(' ', 1)[0] in PATH_LETTERS:
-            letter, path_data = (path_data + ' ').split(' ', 1)
-
-        if letter in 'aA':
-            # Elliptical arc curve
-            rx, ry, path_data = point(None, path_data)
-            rotation, path_data = path_data.split(' ', 1)
-            rotation = radians(float(rotation))
-
-            # The large and sweep values are not always separated from the
-            # following values, here is the crazy parser
-            large, path_data = path_data[0], path_data[1:].strip()
-            while not large[-1].isdigit():
-                large, path_data = large + path_data[0], path_data[1:].strip()
-            sweep, path_data = path_data[0], path_data[1:].strip()
-            while not sweep[-1].isdigit():
-                sweep, path_data = sweep + path_data[0], path_data[1:].strip()
-
-            large, sweep = bool(int(large)), bool(int(sweep))
-
-            x, y, path_data = point(None, path_data)
-
-            # Relative coordinate, convert to absolute
-            if letter == 'a':
-                x += previous_x
-                y += previous_y
-
-            # Extend bounding box with start and end coordinates
-            arc_bounding_box = bounding_box_elliptical_arc(
-                previous_x, previous_y, rx, ry, rotation, large, sweep, x, y)
-            x1, y1, width, height = arc_bounding_box
-            x2 = x1 + width
-            y2 = y1 + height
-            points = (x1, y1), (x2, y2)
-            bounding_box = extend_bounding_box(bounding_box, points)
-            previous_x = x
-            previous_y = y
-
-        elif letter in 'cC':
-            # Curve
-            x1, y1, path_data = point(None, path_data)
-            x2, y2, path_data = point(None, path_data)
-            x, y, path_data = point(None, path_data)
-
-            # Relative coordinates, convert to absolute
-            if letter == 'c':
-                x1 += previous_x
-                y1 += previous_y
-                x2 += previous_x
-                y2 += previous_y
-                x += previous_x
-                y += previous_y
-
-            # Extend bounding box with all coordinates
-            bounding_box = extend_bounding_box(
-                bounding_box, ((x1, y1), (x2, y2), (x, y)))
-            previous_x = x
-            previous_y = y
-
-        elif letter in 'hH':
-            # Horizontal line
-            x, path_data = (path_data + ' ').split(' ', 1)
-            x = size(surface, x, 'x')
-
-            # Relative coordinate, convert to absolute
-            if letter == 'h':
-                x += previous_x
-
-            # Extend bounding box with coordinate
-            bounding_box = extend_bounding_box(
-                bounding_box, ((x, previous_y),))
-            previous_x = x
-
-        elif letter in 'lLmMtT':
-            # Line/Move/Smooth quadratic curve
-            x, y, path_data = point(None, path_data)
-
-            # Relative coordinate, convert to absolute
-            if letter in 'lmt':
-                x += previous_x
-                y += previous_y
-
-            # Extend bounding box with coordinate
-            bounding_box = extend_bounding_box(bounding_box, ((x, y),))
-            previous_x = x
-            previous_y = y
-
-        elif letter in 'qQsS':
-            # Quadratic curve/Smooth curve
-            x1, y1, path_data = point(None, path_data)
-            x, y, path_data = point(None, path_data)
-
-            # Relative coordinates, convert to absolute
-            if letter in 'qs':
-                x1 += previous_x
-                y1 += previous_y
-                x += previous_x
-                y += previous_y
-
-            # Extend bounding box with coordinates
-            bounding_box = extend_bounding_box(
-                bounding_box, ((x1, y1), (x, y)))
-            previous_x = x
-            previous_y = y
-
-        elif letter in 'vV':
-            # Vertical line
-            y, path_data = (path_data + ' ').split(' ', 1)
-            y = size(surface, y, 'y')
-
-            # Relative coordinate, convert to absolute
-            if letter == 'v':
-                y += previous_y
-
-            # Extend bounding box with coordinate
-            bounding_box = extend_bounding_box(
-                bounding_box, ((previous_x, y),))
-            previous_y = y
-
-        path_data = path_data.strip()
+def bounding_box_path(surface, node):
+    """Get the bounding box of a ``path`` node.
 
-    return bounding_box
+    The bounding box is stored in the path data, shared by the nodes with
+    the same path data.
+
+    """
+    from .path import PATH_ARC, path_data  # circular import
+
+    data = path_data(surface, node)
+    if data.bounding_box is None:
+        x_list, y_list = [], []
+        for operation, coordinates in data.commands:
+            if operation == PATH_ARC:
+                for x, y in elliptical_arc_points(*coordinates):
+                    x_list.append(x)
+                    y_list.append(y)
+            else:
+                x_list.extend(coordinates[::2])
+                y_list.extend(coordinates[1::2])
+        data.bounding_box = points_bounding_box(x_list, y_list)
+    return data.bounding_box
+
+
+def points_bounding_box(x_list, y_list):
+    """Get the bounding box of the points with coordinates in the lists."""
+    if not x_list or not y_list:
+        return EMPTY_BOUNDING_BOX
+    minx, miny = min(x_list), min(y_list)
+    return minx, miny, max(x_list) - minx, max(y_list) - miny
 
 
 def bounding_box_text(surface, node):
@@ -220,110 +117,203 @@ def bounding_box_text(surface, node):
     return node.get('text_bounding_box')
 
 
-def angle(bx, by):
-    """Get the angle between vector (1,0) and vector (bx,by)."""
-    return fmod(tau + copysign(acos(bx / hypot(bx, by)), by), tau)
+def elliptical_arc_points(cx, cy, rx, ry, rotation, angle1, angle2):
+    """Get the ends and the extreme points of an elliptical arc."""
+    cos_rotation, sin_rotation = cos(rotation), sin(rotation)
+    angles = [angle1, angle2]
+    start, end = sorted((angle1, angle2))
 
+    # Angles where the x and y derivatives are null
+    for extreme_angle in (
+            atan2(-ry * sin_rotation, rx * cos_rotation),
+            atan2(ry * cos_rotation, rx * sin_rotation)):
+        for angle in (extreme_angle, extreme_angle + pi):
+            angle = start + (angle - start) % tau
+            if angle <= end:
+                angles.append(angle)
 
-def bounding_box_elliptical_arc(x1, y1, rx, ry, phi, large, sweep, x, y):
-    """Get the bounding box of an elliptical arc described by the parameters.
+    return [(
+        cx + rx * cos(angle) * cos_rotation - ry * sin(angle) * sin_rotation,
+        cy + rx * cos(angle) * sin_rotation + ry * sin(angle) * cos_rotation)
+        for angle in angles]
 
-    See following website for original code:
-    http://fridrich.blogspot.nl/2011/06/bounding-box-of-svg-elliptical-arc.html
+
+def stroke_bounding_box(surface, node):
+    """Get the bounding box of a shape ``node``, including its stroke.
+
+    The bounding box is extended by the largest distance the stroke can reach,
+    including miter joins and square caps. Return ``None`` for shapes with
+    filters or markers, that can be drawn anywhere.
 
     """
-    rx, ry = abs(rx), abs(ry)
-    if rx == 0 or ry == 0:
-        return min(x, x1), min(y, y1), abs(x - x1), abs(y - y1)
-
-    x1prime = cos(phi) * (x1 - x) / 2 + sin(phi) * (y1 - y) / 2
-    y1prime = -sin(phi) * (x1 - x) / 2 + cos(phi) * (y1 - y) / 2
-
-    radicant = (
-        rx ** 2 * ry ** 2 - rx ** 2 * y1prime ** 2 - ry ** 2 * x1prime ** 2)
-    radicant /= rx ** 2 * y1prime ** 2 + ry ** 2 * x1prime ** 2
-    cxprime = cyprime = 0
-
-    if radicant < 0:
-        ratio = rx / ry
-        radicant = y1prime ** 2 + x1prime ** 2 / ratio ** 2
-        if radicant < 0:
-            return min(x, x1), min(y, y1), abs(x - x1), abs(y - y1)
-        ry = sqrt(radicant)
-        rx = ratio * ry
-    else:
-        factor = (-1 if large == sweep else 1) * sqrt(radicant)
-
-        cxprime = factor * rx * y1prime / ry
-        cyprime = -factor * ry * x1prime / rx
-
-    cx = cxprime * cos(phi) - cyprime * sin(phi) + (x1 + x) / 2
-    cy = cxprime * sin(phi) + cyprime * cos(phi) + (y1 + y) / 2
-
-    if phi in (0, pi):
-        minx = cx - rx
-        tminx = angle(-rx, 0)
-        maxx = cx + rx
-        tmaxx = angle(rx, 0)
-        miny = cy - ry
-        tminy = angle(0, -ry)
-        maxy = cy + ry
-        tmaxy = angle(0, ry)
-    elif phi in (pi / 2, 3 * pi / 2):
-        minx = cx - ry
-        tminx = angle(-ry, 0)
-        maxx = cx + ry
-        tmaxx = angle(ry, 0)
-        miny = cy - rx
-        tminy = angle(0, -rx)
-        maxy = cy + rx
-        tmaxy = angle(0, rx)
-    else:
-        tminx = -atan(ry * tan(phi) / rx)
-        tmaxx = pi - atan(ry * tan(phi) / rx)
-        minx = cx + rx * cos(tminx) * cos(phi) - ry * sin(tminx) * sin(phi)
-        maxx = cx + rx * cos(tmaxx) * cos(phi) - ry * sin(tmaxx) * sin(phi)
-        if minx > maxx:
-            minx, maxx = maxx, minx
-            tminx, tmaxx = tmaxx, tminx
-        tmp_y = cy + rx * cos(tminx) * sin(phi) + ry * sin(tminx) * cos(phi)
-        tminx = angle(minx - cx, tmp_y - cy)
-        tmp_y = cy + rx * cos(tmaxx) * sin(phi) + ry * sin(tmaxx) * cos(phi)
-        tmaxx = angle(maxx - cx, tmp_y - cy)
-
-        tminy = atan(ry / (tan(phi) * rx))
-        tmaxy = atan(ry / (tan(phi) * rx)) + pi
-        miny = cy + rx * cos(tminy) * sin(phi) + ry * sin(tminy) * cos(phi)
-        maxy = cy + rx * cos(tmaxy) * sin(phi) + ry * sin(tmaxy) * cos(phi)
-        if miny > maxy:
-            miny, maxy = maxy, miny
-            tminy, tmaxy = tmaxy, tminy
-        tmp_x = cx + rx * cos(tminy) * cos(phi) - ry * sin(tminy) * sin(phi)
-        tminy = angle(tmp_x - cx, miny - cy)
-        tmp_x = cx + rx * cos(tmaxy) * cos(phi) - ry * sin(tmaxy) * sin(phi)
-        tmaxy = angle(tmp_x - cx, maxy - cy)
-
-    angle1 = angle(x1 - cx, y1 - cy)
-    angle2 = angle(x - cx, y - cy)
-
-    if not sweep:
-        angle1, angle2 = angle2, angle1
-
-    other_arc = False
-    if angle1 > angle2:
-        angle1, angle2 = angle2, angle1
-        other_arc = True
-
-    if other_arc == (angle1 <= tminx <= angle2):
-        minx = min(x, x1)
-    if other_arc == (angle1 <= tmaxx <= angle2):
-        maxx = max(x, x1)
-    if other_arc == (angle1 <= tminy <= angle2):
-        miny = min(y, y1)
-    if other_arc == (angle1 <= tmaxy <= angle2):
-        maxy = max(y, y1)
+    if node.get('filter') or any(
+            node.get(attribute) and parse_url(node[attribute]).fragment
+            for attribute in (
+                'marker', 'marker-start', 'marker-mid', 'marker-end')):
+        return None
+    bounding_box = BOUNDING_BOX_METHODS[node.tag](surface, node)
+    if not is_valid_bounding_box(bounding_box):
+        return None
+    x, y, width, height = bounding_box
+    stroke = node.get('stroke')
+    if stroke and stroke != 'none':
+        margin = size(surface, node.get('stroke-width', '1')) / 2 * max(
+            float(node.get('stroke-miterlimit', 4)), 2 ** .5)
+        x, y = x - margin, y - margin
+        width, height = width + 2 * margin, height + 2 * margin
+    return x, y, width, height
 
-    return minx, miny, maxx - minx, maxy - miny
+
+def is_outside_clip(surface, node):
+    """Know whether the shape ``node`` is drawn outside of the current clip."""
+    bounding_box = stroke_bounding_box(surface, node)
+    if bounding_box is None:
+        return False
+    x, y, width, height = bounding_box
+    clip_x1, clip_y1, clip_x2, clip_y2 = surface.context.clip_extents()
+    return (
+        x > clip_x2 or y > clip_y2 or
+        x + width < clip_x1 or y + height < clip_y1)
+
+
+class SpatialIndex:
+    """R-tree of values stored with their bounding boxes.
+
+    The tree is packed with the Sort-Tile-Recursive algorithm: boxes are
+    sorted into vertical slices, sorted vertically in each slice, and groups
+    of ``node_size`` consecutive boxes are stored in parent nodes, up to the
+    root. The boxes of each level are stored in a flat array, so that
+    millions of values can be indexed.
+
+    """
+    def __init__(self, items, node_size=16):
+        items = [
+            (bounding_box, value) for bounding_box, value in items
+            if is_valid_bounding_box(bounding_box)]
+        leaves = ceil(len(items) / node_size)
+        slice_size = node_size * max(1, ceil(sqrt(leaves)))
+        items.sort(key=lambda item: 2 * item[0][0] + item[0][2])
+        for i in range(0, len(items), slice_size):
+            items[i:i + slice_size] = sorted(
+                items[i:i + slice_size],
+                key=lambda item: 2 * item[0][1] + item[0][3])
+
+        self.node_size = node_size
+        self.values = [value for _, value in items]
+        self.ids = None
+        self.key = None
+        boxes = array('d')
+        for (x, y, width, height), _ in items:
+            boxes.extend((x, y, x + width, y + height))
+        self.levels = [boxes]
+        while len(boxes) > 4 * node_size:
+            parent_boxes = array('d')
+            for i in range(0, len(boxes), 4 * node_size):
+                children = boxes[i:i + 4 * node_size]
+                parent_boxes.extend((
+                    min(children[0::4]), min(children[1::4]),
+                    max(children[2::4]), max(children[3::4])))
+            self.levels.append(parent_boxes)
+            boxes = parent_boxes
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, value):
+        """Know whether ``value`` itself is stored in the index."""
+        if self.ids is None:
+            self.ids = frozenset(id(value) for value in self.values)
+        return id(value) in self.ids
+
+    def intersection(self, bounding_box):
+        """Get the values whose bounding boxes intersect ``bounding_box``."""
+        x, y, width, height = bounding_box
+        max_x, max_y = x + width, y + height
+        values = []
+        top = len(self.levels) - 1
+        ranges = [(top, 0, len(self.levels[top]) // 4)]
+        while ranges:
+            level, start, end = ranges.pop()
+            boxes = self.levels[level]
+            for i in range(start, end):
+                if (boxes[4 * i] <= max_x and boxes[4 * i + 1] <= max_y and
+                        boxes[4 * i + 2] >= x and boxes[4 * i + 3] >= y):
+                    if level:
+                        ranges.append((
+                            level - 1, i * self.node_size, min(
+                                (i + 1) * self.node_size,
+                                len(self.levels[level - 1]) // 4)))
+                    else:
+                        values.append(self.values[i])
+        return values
+
+    def at_point(self, x, y):
+        """Get the values whose bounding boxes include the point."""
+        return self.intersection((x, y, 0, 0))
+
+
+def calculate_spatial_index(surface, tree):
+    """Calculate the :class:`SpatialIndex` of the elements drawn for ``tree``.
+
+    Nodes are stored with bounding boxes including their strokes and their
+    transformations, in the user units of ``tree``. Nodes whose extents are
+    unknown, such as texts, images or shapes with filters, are not stored, nor
+    are the groups including them. Original nodes are stored for clones, so
+    that the index is shared by all the clones of a tree.
+
+    """
+    from .surface import INVISIBLE_TAGS, PATH_TAGS, TAGS  # circular import
+
+    items = []
+    tree_matrix = surface.context.get_matrix()
+    tree_matrix.invert()
+
+    def node_bounding_box(node, coefficients):
+        if node.tag == 'defs' or node.tag in INVISIBLE_TAGS:
+            return EMPTY_BOUNDING_BOX
+        if node.get('filter') or (
+                node is not tree and node.tag in TAGS and
+                node.tag not in PATH_TAGS and node.tag != 'g'):
+            return None
+
+        old_font_size = surface.font_size
+        surface.font_size = size(surface, node.get('font-size', '12pt'))
+        transform_string = node.get('transform')
+        if transform_string:
+            surface.context.save()
+            transform(
+                surface, transform_string,
+                transform_origin=node.get('transform-origin'))
+            coefficients = surface.context.get_matrix().multiply(
+                tree_matrix).as_tuple()
+
+        if node.tag in PATH_TAGS:
+            bounding_box = stroke_bounding_box(surface, node)
+            if bounding_box and coefficients != (1, 0, 0, 1, 0, 0):
+                xx, yx, xy, yy, x0, y0 = coefficients
+                x, y, width, height = bounding_box
+                bounding_box = extend_bounding_box(EMPTY_BOUNDING_BOX, [
+                    (xx * px + xy * py + x0, yx * px + yy * py + y0)
+                    for px in (x, x + width) for py in (y, y + height)])
+        else:
+            bounding_box = EMPTY_BOUNDING_BOX
+            for child in node.children:
+                child_bounding_box = node_bounding_box(child, coefficients)
+                if bounding_box is not None:
+                    bounding_box = (
+                        None if child_bounding_box is None else
+                        combine_bounding_box(bounding_box, child_bounding_box))
+        if transform_string:
+            surface.context.restore()
+        surface.font_size = old_font_size
+
+        if node is not tree and is_valid_bounding_box(bounding_box):
+            original = node if node.original is None else node.original
+            items.append((bounding_box, original))
+        return bounding_box
+
+    node_bounding_box(tree, (1, 0, 0, 1, 0, 0))
+    return SpatialIndex(items)
 
 
 def bounding_box_group(surface, node):
@@ -354,8 +344,8 @@ def extend_bounding_box(bounding_box, points):
         float('-inf') if isinf(miny) else miny + height)
     x_list, y_list = zip(*points)
     minx, miny, maxx, maxy = (
-        min(minx, *x_list), min(miny, *y_list),
-        max(maxx, *x_list), max(maxy, *y_list))
+        min(minx, min(x_list)), min(miny, min(y_list)),
+        max(maxx, max(x_list)), max(maxy, max(y_list)))
     return minx, miny, maxx - minx, maxy - miny
 
 
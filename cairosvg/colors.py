@@ -4,6 +4,7 @@ SVG colors.
 """
 
 import re
+from functools import lru_cache
 
 COLORS = {
     'aliceblue': (240 / 255, 248 / 255, 255 / 255, 1),
@@ -193,11 +194,14 @@ HEX_RRGGBB = re.compile('#[0-9a-f]{6}')
 HEX_RGB = re.compile('#[0-9a-f]{3}')
 
 
+@lru_cache(maxsize=4096)
 def color(string, opacity=1):
     """Replace ``string`` representing a color by a RGBA tuple.
 
     See http://www.w3.org/TR/SVG/types.html#DataTypeColor
 
+    Results are cached, as the same colors are used by many nodes.
+
     """
     if not string:
         return (0, 0, 0, 0)
@@ -3,6 +3,9 @@ Handle CSS stylesheets.
 
 """
 
+from functools import lru_cache
+from sys import intern
+
 import cssselect2
 import tinycss2
 
@@ -61,33 +64,145 @@ def parse_declarations(input):
             declarations = (
                 important_declarations if declaration.important
                 else normal_declarations)
-            declarations.append((declaration.lower_name, value))
+            # Names are interned, as they are stored in each node
+            declarations.append((intern(declaration.lower_name), value))
     return normal_declarations, important_declarations
 
 
+def selector_attributes(prelude):
+    """Get the attributes tested by the selectors in ``prelude``.
+
+    Return ``None`` if selectors depend on something else than the tags and
+    the attributes of elements and of their ancestors, ie. if they include
+    pseudo-classes, sibling combinators or namespaced attributes.
+
+    """
+    attributes = set()
+    for token in prelude:
+        if token.type == 'literal' and token.value in (':', '+', '~'):
+            return
+        elif token.type == '[] block':
+            names = [
+                token for token in token.content
+                if token.type not in ('whitespace', 'comment')]
+            if not names or names[0].type != 'ident' or (
+                    len(names) > 1 and names[1] == '|'):
+                return
+            attributes.add(names[0].value)
+    return attributes
+
+
+class StyleMatcher:
+    """Matcher of the normal and !important declarations of CSS rules.
+
+    Matching results are cached for elements with the same signature, made of
+    the tags and of the attributes tested by selectors of the elements and of
+    their ancestors. Results are not cached when selectors test something else,
+    such as siblings or pseudo-classes.
+
+    """
+    def __init__(self):
+        self.normal_matcher = cssselect2.Matcher()
+        self.important_matcher = cssselect2.Matcher()
+        self.attributes = {'id', 'class'}
+        self.matches = {}
+
+    def add_rule(self, rule):
+        """Add the selectors and the declarations of ``rule``."""
+        normal_declarations, important_declarations = parse_declarations(
+            rule.content)
+        added = False
+        for selector in cssselect2.compile_selector_list(rule.prelude):
+            if selector.pseudo_element is None and not selector.never_matches:
+                if normal_declarations:
+                    self.normal_matcher.add_selector(
+                        selector, normal_declarations)
+                if important_declarations:
+                    self.important_matcher.add_selector(
+                        selector, important_declarations)
+                added = True
+        if added and self.matches is not None:
+            attributes = selector_attributes(rule.prelude)
+            if attributes is None:
+                self.matches = None
+            else:
+                self.attributes.update(attributes)
+        return added
+
+    def match(self, element):
+        """Get the normal and important declarations matching ``element``."""
+        if self.matches is None:
+            return self.match_selectors(element)
+        signature = []
+        ancestor = element
+        while ancestor is not None:
+            attributes = ancestor.etree_element.attrib
+            signature.append(ancestor.etree_element.tag)
+            signature.extend(attributes.get(name) for name in self.attributes)
+            ancestor = ancestor.parent
+        signature = tuple(signature)
+        if signature not in self.matches:
+            self.matches[signature] = self.match_selectors(element)
+        return self.matches[signature]
+
+    def match_selectors(self, element):
+        normal = [rule[-1] for rule in self.normal_matcher.match(element)]
+        important = [
+            rule[-1] for rule in self.important_matcher.match(element)]
+        return normal, important
+
+
+@lru_cache(maxsize=4096)
+def parse_style_attribute(style):
+    """Parse the declarations of a ``style`` attribute, as tuples.
+
+    Results are cached, as many elements share the same style attribute. The
+    least recently used results are removed when the cache is full.
+
+    """
+    normal_declarations, important_declarations = parse_declarations(style)
+    return tuple(normal_declarations), tuple(important_declarations)
+
+
 def parse_stylesheets(tree, url):
     """Find and parse the stylesheets in ``tree``.
 
-    Return two :class:`cssselect2.Matcher` objects,
-    for normal and !important declarations.
+    Return a :class:`StyleMatcher`, or ``None`` if ``tree`` has no CSS rules.
 
     """
-    normal_matcher = cssselect2.Matcher()
-    important_matcher = cssselect2.Matcher()
+    style = StyleMatcher()
+    has_rules = False
     for stylesheet in find_stylesheets(tree):
         for rule in find_stylesheets_rules(tree, stylesheet, url):
-            normal_declarations, important_declarations = parse_declarations(
-                rule.content)
-            for selector in cssselect2.compile_selector_list(rule.prelude):
-                if (selector.pseudo_element is None and
-                        not selector.never_matches):
-                    if normal_declarations:
-                        normal_matcher.add_selector(
-                            selector, normal_declarations)
-                    if important_declarations:
-                        important_matcher.add_selector(
-                            selector, important_declarations)
-    return normal_matcher, important_matcher
+            has_rules = style.add_rule(rule) or has_rules
+    if has_rules:
+        return style
+
+
+def cascade(element, style):
+    """Return the properties of ``element``, with ``style`` rules applied.
+
+    ``style`` is the value returned by :func:`parse_stylesheets`, elements
+    are not matched by selectors when it is ``None``.
+
+    """
+    attributes = element.etree_element.attrib
+    properties = dict(attributes)
+    style_attr = attributes.get('style')
+    if style_attr:
+        normal_attr, important_attr = parse_style_attribute(style_attr)
+    else:
+        normal_attr = important_attr = ()
+    if style is None:
+        normal = important = ()
+    else:
+        normal, important = style.match(element)
+    for declaration_lists in (
+            normal, [normal_attr], important, [important_attr]):
+        for declarations in declaration_lists:
+            for name, value in declarations:
+                properties[name] = value.strip()
+    return properties
 
 
 def get_declarations(rule):
@@ -5,6 +5,8 @@ This module handles clips, gradients, masks, patterns and external nodes.
 
 """
 
+from weakref import WeakKeyDictionary
+
 from .bounding_box import calculate_bounding_box, is_non_empty_bounding_box
 from .features import match_features
 from .helpers import paint, size, transform
@@ -49,23 +51,78 @@ def update_def_href(surface, def_name, def_dict, chain=None):
                 def_dict[def_name][key] = value
 
 
-def parse_all_defs(surface, node):
+DEF_TYPES = (
+    'marker', 'gradient', 'pattern', 'path', 'mask', 'filter', 'image')
+
+
+# Elements including definitions, stored for the root elements of trees
+DEFINITION_PARENTS = WeakKeyDictionary()
+
+
+def definition_parents(root):
+    """Get the elements of ``root`` including definitions with an id.
+
+    The XML tree is walked once, the set is then stored for ``root``.
+
+    """
+    if root in DEFINITION_PARENTS:
+        return DEFINITION_PARENTS[root]
+    parents = set()
+    ancestors = []
+    elements = [(root, 0)]
+    while elements:
+        element, depth = elements.pop()
+        del ancestors[depth:]
+        if depth and isinstance(element.tag, str) and 'id' in element.attrib:
+            tag = element.tag.lower()
+            if any(def_type in tag for def_type in DEF_TYPES):
+                # Ancestors of parents already include definitions
+                for ancestor in reversed(ancestors):
+                    if ancestor in parents:
+                        break
+                    parents.add(ancestor)
+        ancestors.append(element)
+        elements.extend((child, depth + 1) for child in element)
+    parents = DEFINITION_PARENTS[root] = frozenset(parents)
+    return parents
+
+
+def has_defs(node, parents=None):
+    """Know whether definitions may be found in the children of ``node``.
+
+    Children of lazy nodes are not created when their XML elements don't
+    include definitions with an id. ``parents`` is the set of elements
+    including definitions, given by :func:`definition_parents`.
+
+    """
+    if not node.lazy or node.element is None:
+        return True
+    element = node.element.etree_element
+    if parents is None:
+        parents = definition_parents(element)
+    return element in parents
+
+
+def parse_all_defs(surface, node, parents=None):
     """Recursively visit all child nodes and process definition elements."""
 
     # Handle node
     parse_def(surface, node)
 
+    # Find the elements including definitions once for each tree
+    if node.lazy and node.element is not None and (
+            parents is None or node.root):
+        parents = definition_parents(node.element.etree_element)
+
     # Visit all children recursively
-    if node.children:
+    if has_defs(node, parents) and node.children:
         for child in node.children:
-            parse_all_defs(surface, child)
+            parse_all_defs(surface, child, parents)
 
 
 def parse_def(surface, node):
     """Parse the SVG definitions."""
-    for def_type in (
-            'marker', 'gradient', 'pattern', 'path', 'mask', 'filter',
-            'image'):
+    for def_type in DEF_TYPES:
         if def_type in node.tag.lower() and 'id' in node:
             getattr(surface, f'{def_type}s')[node['id']] = node
 
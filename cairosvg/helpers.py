@@ -4,7 +4,9 @@ Surface helpers.
 """
 
 import re
-from math import atan2, cos, hypot, radians, sin, tan
+from array import array
+from functools import lru_cache
+from math import asin, atan2, cos, hypot, pi, radians, sin, tan, tau
 
 from .surface import cairo
 from .url import parse_url
@@ -22,11 +24,45 @@ PAINT_URL = re.compile(r'(url\(.+\)) *(.*)')
 PATH_LETTERS = 'achlmqstvzACHLMQSTVZ'
 RECT = re.compile(r'rect\( ?(.+?) ?\)')
 
+# Tokens of path data: commands, numbers followed by their units, and other
+# characters
+PATH_TOKENS = re.compile(
+    rf'[{PATH_LETTERS}]|'
+    rf'[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?[^\s,+\-.\d{PATH_LETTERS}]*|'
+    r'[^\s,]')
+
+# Elliptical arcs are not handled by cairo paths, they're drawn with curves
+PATH_ARC = 'arc'
+
 
 class PointError(Exception):
     """Exception raised when parsing a point fails."""
 
 
+class PathData:
+    """Parsed path data, shared by drawing, bounding boxes and markers.
+
+    ``commands`` is a tuple of ``(operation, points)`` tuples with absolute
+    coordinates, in the format accepted by cairo's ``append_path``. Elliptical
+    arcs are stored as ``(PATH_ARC, (cx, cy, rx, ry, rotation, angle1,
+    angle2))`` tuples, with the center of the ellipse, its radii and rotation,
+    and the angles where the arc starts and ends. The arc is drawn clockwise
+    if ``angle2`` is greater than ``angle1``, counterclockwise otherwise.
+
+    ``vertices`` is an array of the points and tangent angles used to draw
+    markers, as described in :func:`cairosvg.path.draw_markers`.
+
+    ``bounding_box`` is set when the bounding box of the path is first
+    needed.
+
+    """
+    def __init__(self, commands, vertices):
+        self.commands = commands
+        self.vertices = vertices
+        self.bounding_box = None
+        self.arcs = any(command[0] == PATH_ARC for command in commands)
+
+
 def distance(x1, y1, x2, y2):
     """Get the distance between two points."""
     return hypot(x2 - x1, y2 - y1)
@@ -65,13 +101,19 @@ def node_format(surface, node, reference=True):
     height = size(surface, node.get('height', '100%'), reference_size[1])
     viewbox = node.get('viewBox')
     if viewbox:
-        viewbox = re.sub('[ \n\r\t,]+', ' ', viewbox)
-        viewbox = tuple(float(position) for position in viewbox.split())
+        viewbox = parse_viewbox(viewbox)
         width = width or viewbox[2]
         height = height or viewbox[3]
     return width, height, viewbox
 
 
+@lru_cache(maxsize=4096)
+def parse_viewbox(string):
+    """Return the tuple of floats given by a viewBox ``string``."""
+    string = re.sub('[ \n\r\t,]+', ' ', string)
+    return tuple(float(position) for position in string.split())
+
+
 def normalize(string):
     """Normalize a string corresponding to an array of various values."""
     string = string.replace('E', 'e')
@@ -92,11 +134,115 @@ def point(surface, string):
         raise PointError
 
 
+def parse_points(surface, string):
+    """Return an array of the coordinates of the points in ``string``."""
+    string = normalize(string)
+    if not string:
+        return array('d')
+    tokens = string.split(' ')
+    try:
+        return array('d', map(float, tokens))
+    except ValueError:
+        # Some coordinates have units
+        return array('d', (
+            size(surface, token, 'y' if i % 2 else 'x')
+            for i, token in enumerate(tokens)))
+
+
+def path_commands(surface, string):
+    """Yield ``(letter, values)`` for each command of path data ``string``.
+
+    Values are floats, except for the flags of elliptic curves that are
+    integers and for their rotation that is given in degrees. Implicit
+    commands repeating moves are given as lines.
+
+    """
+    tokens = PATH_TOKENS.findall(string)
+    length = len(tokens)
+    index = 0
+    letter = None
+
+    def token():
+        nonlocal index
+        if index >= length:
+            raise PointError
+        index += 1
+        return tokens[index - 1]
+
+    def number(reference):
+        string = token()
+        try:
+            return float(string)
+        except ValueError:
+            return size(surface, string, reference)
+
+    def flag():
+        nonlocal index
+        string = token()
+        if len(string) > 1:
+            # Flags are not always separated from the following values
+            index -= 1
+            tokens[index] = string[1:]
+        return int(string[0])
+
+    while index < length:
+        if tokens[index] in PATH_LETTERS:
+            letter = tokens[index]
+            index += 1
+        elif letter is None or letter in 'zZ':
+            # Values without command
+            return
+        elif letter == 'M':
+            letter = 'L'
+        elif letter == 'm':
+            letter = 'l'
+
+        if letter in 'aA':
+            values = (
+                number('x'), number('y'), float(token()), flag(), flag(),
+                number('x'), number('y'))
+        elif letter in 'cC':
+            values = tuple(number(reference) for reference in 'xyxyxy')
+        elif letter in 'qQsS':
+            values = tuple(number(reference) for reference in 'xyxy')
+        elif letter in 'lLmMtT':
+            values = number('x'), number('y')
+        elif letter in 'hHvV':
+            # Missing values are read as 0
+            reference = 'x' if letter in 'hH' else 'y'
+            values = (number(reference) if index < length else 0,)
+        else:
+            values = ()
+        yield letter, values
+
+
 def point_angle(cx, cy, px, py):
     """Return angle between x axis and point knowing given center."""
     return atan2(py - cy, px - cx)
 
 
+def output_size(width, height, scale=1, output_width=None,
+                output_height=None):
+    """Return the output size of a drawing of size ``(width, height)``.
+
+    The aspect ratio is kept when only one of the output sizes is given.
+
+    """
+    if output_width and output_height:
+        return output_width, output_height
+    elif output_width:
+        if width:
+            # Keep the aspect ratio
+            height *= output_width / width
+        return output_width, height
+    elif output_height:
+        if height:
+            # Keep the aspect ratio
+            width *= output_height / height
+        return width, output_height
+    return width * scale, height * scale
+
+
 def preserve_ratio(surface, node, width=None, height=None):
     """Manage the ratio preservation."""
     if node.tag == 'marker':
@@ -194,59 +340,133 @@ def rotate(x, y, angle):
     return x * cos(angle) - y * sin(angle), y * cos(angle) + x * sin(angle)
 
 
-def transform(surface, transform_string, gradient=None, transform_origin=None):
-    """Transform ``surface`` or ``gradient`` if supplied using ``string``.
+def simplify_points(points, tolerance):
+    """Remove points of a polyline, keeping it within ``tolerance``.
 
-    See http://www.w3.org/TR/SVG/coords.html#TransformAttribute
+    Points are removed as long as they are closer than ``tolerance`` to the
+    line joining the last kept point and the next one, in a single pass: the
+    directions allowed for the line are narrowed by each removed point. The
+    first and last points are always kept.
 
     """
-    if not transform_string:
-        return
-
-    transformations = re.findall(
-        r'(\w+) ?\( ?(.*?) ?\)', normalize(transform_string))
-    matrix = cairo.Matrix()
+    if len(points) < 3:
+        return points
+    kept = [points[0]]
+    start_x, start_y = points[0]
+    reference = None
+    minimum = maximum = farthest = 0
+    for i, (x, y) in enumerate(points[1:], start=1):
+        length = hypot(x - start_x, y - start_y)
+        if reference is not None:
+            angle = (
+                atan2(y - start_y, x - start_x) - reference + pi) % tau - pi
+            if not (minimum <= angle <= maximum and length >= farthest):
+                # Keep the previous point and start a new line from it
+                kept.append(points[i - 1])
+                start_x, start_y = points[i - 1]
+                length = hypot(x - start_x, y - start_y)
+                reference = None
+        if length > tolerance:
+            if reference is None:
+                reference = atan2(y - start_y, x - start_x)
+                angle, minimum, maximum, farthest = 0, -pi, pi, 0
+            delta = asin(tolerance / length)
+            minimum = max(minimum, angle - delta)
+            maximum = min(maximum, angle + delta)
+            farthest = max(farthest, length)
+    kept.append(points[-1])
+    return kept
+
+
+def simplify_path(surface, path):
+    """Simplify the cairo ``path`` according to the surface level of detail.
+
+    Lines are merged and curves smaller than the tolerance are replaced by
+    lines, as long as the path stays within ``surface.simplify_tolerance``
+    device units of the original one. The path is returned unchanged when no
+    tolerance is set, or when dashes depend on the length of its segments.
 
-    if transform_origin:
-        origin = transform_origin.split(' ')
-        origin_x = origin[0]
-        if len(origin) == 1:
-            if origin_x in ('top', 'bottom'):
-                origin_y = origin_x
-                origin_x = surface.width / 2
-            else:
-                origin_y = surface.height / 2
-        elif len(origin) > 1:
-            if origin_x in ('top', 'bottom'):
-                origin_y = origin_x
-                origin_x = origin[1]
-            else:
-                origin_y = origin[1]
+    """
+    if not surface.simplify_tolerance or surface.context.get_dash_count():
+        return path
+    xx, yx, xy, yy, _, _ = surface.context.get_matrix().as_tuple()
+    # The norm is an upper bound of the distances scaling
+    scale = hypot(xx, yx, xy, yy)
+    if not scale:
+        return path
+    tolerance = surface.simplify_tolerance / scale
+
+    simplified = []
+    current = (
+        surface.context.get_current_point()
+        if surface.context.has_current_point() else None)
+    start = None
+    run = [current]
+    for operation, points in path:
+        end = points[-2:]
+        if current is not None and operation == cairo.PATH_CURVE_TO:
+            x, y = current
+            if all(
+                    hypot(points[i] - x, points[i + 1] - y) < tolerance / 2
+                    for i in (0, 2, 4)):
+                # Curve inside a circle smaller than the tolerance
+                operation = cairo.PATH_LINE_TO
+                points = end
+        if current is not None and operation == cairo.PATH_LINE_TO:
+            run.append(end)
+            current = end
+            continue
+        simplified.extend(
+            (cairo.PATH_LINE_TO, point)
+            for point in simplify_points(run, tolerance)[1:])
+        simplified.append((operation, points))
+        if operation == cairo.PATH_MOVE_TO:
+            current = start = end
+        elif operation == cairo.PATH_CLOSE_PATH:
+            current = start
         else:
-            return
+            current = end
+        run = [current]
+    simplified.extend(
+        (cairo.PATH_LINE_TO, point)
+        for point in simplify_points(run, tolerance)[1:])
+    return simplified
 
-        if origin_x == 'center':
-            origin_x = surface.width / 2
-        elif origin_x == 'left':
-            origin_x = 0
-        elif origin_x == 'right':
-            origin_x = surface.width
-        else:
-            origin_x = size(surface, origin_x, 'x')
-
-        if origin_y == 'center':
-            origin_y = surface.height / 2
-        elif origin_y == 'top':
-            origin_y = 0
-        elif origin_y == 'bottom':
-            origin_y = surface.height
-        else:
-            origin_y = size(surface, origin_y, 'y')
 
-        matrix.translate(float(origin_x), float(origin_y))
+@lru_cache(maxsize=4096)
+def parse_transform(transform_string):
+    """Return the ``(type, values)`` transformations of ``transform_string``.
 
-    for transformation_type, transformation in transformations:
-        values = [size(surface, value) for value in transformation.split(' ')]
+    See http://www.w3.org/TR/SVG/coords.html#TransformAttribute
+
+    """
+    return tuple(
+        (transformation_type, tuple(transformation.split(' ')))
+        for transformation_type, transformation in re.findall(
+            r'(\w+) ?\( ?(.*?) ?\)', normalize(transform_string)))
+
+
+@lru_cache(maxsize=4096)
+def transform_coefficients(transform_string):
+    """Return the matrix coefficients of ``transform_string``.
+
+    Return ``None`` if the matrix depends on the surface, ie. if values have
+    units.
+
+    """
+    transformations = parse_transform(transform_string)
+    for _, values in transformations:
+        for value in values:
+            if value and parse_size(value)[1] is not None:
+                return
+    return apply_transformations(
+        None, transformations, cairo.Matrix()).as_tuple()
+
+
+def apply_transformations(surface, transformations, matrix):
+    """Return ``matrix`` transformed by ``transformations``."""
+    for transformation_type, values in transformations:
+        values = [size(surface, value) for value in values]
         if transformation_type == 'matrix':
             matrix = cairo.Matrix(*values).multiply(matrix)
         elif transformation_type == 'rotate':
@@ -269,9 +489,68 @@ def transform(surface, transform_string, gradient=None, transform_origin=None):
             if len(values) == 1:
                 values = 2 * values
             matrix.scale(*values[:2])
+    return matrix
+
 
-    if transform_origin:
-        matrix.translate(-float(origin_x), -float(origin_y))
+def transform(surface, transform_string, gradient=None, transform_origin=None):
+    """Transform ``surface`` or ``gradient`` if supplied using ``string``.
+
+    See http://www.w3.org/TR/SVG/coords.html#TransformAttribute
+
+    """
+    if not transform_string:
+        return
+
+    coefficients = (
+        None if transform_origin else transform_coefficients(transform_string))
+    if coefficients:
+        matrix = cairo.Matrix(*coefficients)
+    else:
+        matrix = cairo.Matrix()
+        transformations = parse_transform(transform_string)
+
+        if transform_origin:
+            origin = transform_origin.split(' ')
+            origin_x = origin[0]
+            if len(origin) == 1:
+                if origin_x in ('top', 'bottom'):
+                    origin_y = origin_x
+                    origin_x = surface.width / 2
+                else:
+                    origin_y = surface.height / 2
+            elif len(origin) > 1:
+                if origin_x in ('top', 'bottom'):
+                    origin_y = origin_x
+                    origin_x = origin[1]
+                else:
+                    origin_y = origin[1]
+            else:
+                return
+
+            if origin_x == 'center':
+                origin_x = surface.width / 2
+            elif origin_x == 'left':
+                origin_x = 0
+            elif origin_x == 'right':
+                origin_x = surface.width
+            else:
+                origin_x = size(surface, origin_x, 'x')
+
+            if origin_y == 'center':
+                origin_y = surface.height / 2
+            elif origin_y == 'top':
+                origin_y = 0
+            elif origin_y == 'bottom':
+                origin_y = surface.height
+            else:
+                origin_y = size(surface, origin_y, 'y')
+
+            matrix.translate(float(origin_x), float(origin_y))
+
+        matrix = apply_transformations(surface, transformations, matrix)
+
+        if transform_origin:
+            matrix.translate(-float(origin_x), -float(origin_y))
 
     try:
         matrix.invert()
@@ -352,17 +631,19 @@ def size(surface, string, reference='xy'):
         return 0
 
     try:
-        return float(string)
+        number, unit = parse_size(string)
     except ValueError:
-        # Not a float, try something else
-        pass
-
-    # No surface (for parsing only)
-    if surface is None:
+        # No surface (for parsing only)
+        if surface is None:
+            return 0
+        raise
+
+    if unit is None:
+        return number
+    elif surface is None:
+        # No surface (for parsing only)
         return 0
-
-    string = normalize(string).split(' ', 1)[0]
-    if string.endswith('%'):
+    elif unit == '%':
         if reference == 'x':
             reference = surface.context_width or 0
         elif reference == 'y':
@@ -371,20 +652,38 @@ def size(surface, string, reference='xy'):
             reference = (
                 hypot(surface.context_width, surface.context_height) / 2 ** .5
             )
-        return float(string[:-1]) * reference / 100
-    elif string.endswith('em'):
-        return surface.font_size * float(string[:-2])
-    elif string.endswith('ex'):
-        # Assume that 1em == 2ex
-        return surface.font_size * float(string[:-2]) / 2
-    elif string.endswith('ch'):
-        # A '0' must be assumed to be 0.5em wide.
-        return surface.font_size * float(string[:-2]) / 2
-
-    for unit, coefficient in UNITS.items():
-        if string.endswith(unit):
-            number = float(string[:-len(unit)])
-            return number * (surface.dpi * coefficient if coefficient else 1)
+        return number * reference / 100
+    elif unit == 'em':
+        return surface.font_size * number
+    elif unit in ('ex', 'ch'):
+        # Assume that 1em == 2ex, a '0' must be assumed to be 0.5em wide
+        return surface.font_size * number / 2
+    elif unit in UNITS:
+        coefficient = UNITS[unit]
+        return number * (surface.dpi * coefficient if coefficient else 1)
 
     # Unknown size
     return 0
+
+
+@lru_cache(maxsize=4096)
+def parse_size(string):
+    """Return ``(number, unit)`` from a size ``string``.
+
+    ``unit`` is ``None`` for numbers without units and an empty string for
+    unknown units. Units are resolved by :func:`size`, as they depend on the
+    surface.
+
+    """
+    try:
+        return float(string), None
+    except ValueError:
+        # Not a float, try something else
+        pass
+
+    string = normalize(string).split(' ', 1)[0]
+    for unit in ('%', 'em', 'ex', 'ch', *UNITS):
+        if string.endswith(unit):
+            return float(string[:-len(unit)]), unit
+
+    return 0, ''
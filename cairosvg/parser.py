@@ -4,16 +4,21 @@ SVG Parser.
 """
 
 import gzip
+import json
 import re
+from array import array
+from collections import OrderedDict
+from hashlib import sha256
 from urllib.parse import urlunparse
+from weakref import WeakKeyDictionary
 from xml.etree.ElementTree import Element
 
 import cssselect2
 from defusedxml import ElementTree
 
-from . import css
+from . import VERSION, css
 from .features import match_features
-from .helpers import flatten, pop_rotation, rotations
+from .helpers import PathData, flatten, pop_rotation, rotations
 from .url import fetch, parse_url, read_url, safe_fetch
 
 # 'display' is actually inherited but handled differently because some markers
@@ -44,6 +49,19 @@ NOT_INHERITED_ATTRIBUTES = frozenset((
     'href',
 ))
 
+# Marker for missing properties, as None can be a valid value
+MISSING = object()
+
+# Properties set when drawing, that don't change the geometry of nodes
+COMPUTED_PROPERTIES = frozenset(('bounding_box', 'text_bounding_box'))
+
+# Start of compiled documents, followed by the version of CairoSVG
+COMPILED_HEADER = b'CairoSVG compiled document '
+
+# Path data of the XML elements of compiled documents
+COMPILED_PATH_DATA = WeakKeyDictionary()
+
+
 COLOR_ATTRIBUTES = frozenset((
     'fill',
     'flood-color',
@@ -151,74 +169,130 @@ def normalize_font_style_declaration(value):
     """, lambda match: match.group().lower(), value, 0, re.VERBOSE)
 
 
+class ElementTreeWrapper:
+    """Light version of :class:`cssselect2.ElementWrapper`.
+
+    Elements of documents without stylesheets are not matched by selectors,
+    they only need to give their ElementTree element and their children.
+
+    """
+    __slots__ = ('etree_element',)
+
+    def __init__(self, etree_element):
+        self.etree_element = etree_element
+
+    def iter_children(self):
+        for child in self.etree_element:
+            if isinstance(child.tag, str):
+                yield ElementTreeWrapper(child)
+
+
+class ElementIds:
+    """Index of the elements of an XML tree by id.
+
+    The index is filled while it is searched, elements are walked only once in
+    document order. When multiple elements share the same id, the first one
+    is kept.
+
+    ``ids`` can be given when the index is already known, as for compiled
+    documents.
+
+    """
+
+    def __init__(self, xml_tree, ids=None):
+        if ids is None:
+            self.ids = {}
+            self.elements = cssselect2.ElementWrapper.from_xml_root(
+                xml_tree).iter_subtree()
+        else:
+            self.ids = ids
+            self.elements = iter(())
+
+    def get(self, element_id):
+        """Get the element wrapper with ``element_id``, or ``None``."""
+        if element_id in self.ids:
+            return self.ids[element_id]
+        for element in self.elements:
+            if element.id is not None:
+                self.ids.setdefault(element.id, element)
+                if element.id == element_id:
+                    return element
+
+
 class Node(dict):
-    """SVG node with dict-like properties and children."""
+    """SVG node with dict-like properties and children.
+
+    Only the properties set on the node are stored in the dict, inherited
+    properties are stored in a dict shared by all the children of the parent
+    node. The usual dict API gives access to both.
+
+    """
+    __slots__ = (
+        '_children', 'element', 'ids', 'image_height', 'image_width',
+        'inherited', 'layer', 'lazy', 'original', 'parent', 'path_data',
+        'plan', 'points_bounding_box', 'root', 'spatial_index', 'style',
+        'tag', 'text', 'unsafe', 'url', 'url_fetcher', 'vertices', 'xml_tree')
 
     def __init__(self, element, style, url_fetcher, parent=None,
                  parent_children=False, url=None, unsafe=False):
         """Create the Node from ElementTree ``node``, with ``parent`` Node."""
         super().__init__()
+        self.inherited = None
+        self.layer = None
         self.children = ()
 
         self.root = False
+        self.ids = getattr(self, 'ids', None)
+        self.original = None
 
         node = element.etree_element
         self.element = element
         self.style = style
-        self.tag = (
-            element.local_name
-            if element.namespace_url in ('', 'http://www.w3.org/2000/svg') else
-            f'{{{element.namespace_url}}}{element.local_name}')
+        self.tag = node.tag
+        if self.tag.startswith('{http://www.w3.org/2000/svg}'):
+            self.tag = self.tag[28:]
         self.text = node.text
         self.url_fetcher = url_fetcher
         self.unsafe = unsafe
 
         # Only set xml_tree if it's not been set before (ie. if node is a tree)
         self.xml_tree = getattr(self, 'xml_tree', node)
+        self.lazy = getattr(
+            self, 'lazy', parent.lazy if parent is not None else False)
 
         # Inherits from parent properties
         if parent is not None:
-            self.update([
-                (attribute, parent[attribute]) for attribute in parent
-                if attribute not in NOT_INHERITED_ATTRIBUTES])
+            self.inherited = parent.inheritable_layer()
             self.url = url or parent.url
             self.parent = parent
         else:
             self.url = getattr(self, 'url', None)
             self.parent = getattr(self, 'parent', None)
 
-        self.update(self.xml_tree.attrib)
-
         # Apply CSS rules
-        style_attr = node.get('style')
-        if style_attr:
-            normal_attr, important_attr = css.parse_declarations(style_attr)
-        else:
-            normal_attr = []
-            important_attr = []
-        normal_matcher, important_matcher = style
-        normal = [rule[-1] for rule in normal_matcher.match(element)]
-        important = [rule[-1] for rule in important_matcher.match(element)]
-        for declaration_lists in (
-                normal, [normal_attr], important, [important_attr]):
-            for declarations in declaration_lists:
-                for name, value in declarations:
-                    self[name] = value.strip()
-
-        # Replace currentColor by a real color value
+        self.update(css.cascade(element, style))
+
+        # Replace currentColor by a real color value, inherited values have
+        # already been replaced in parents
         for attribute in COLOR_ATTRIBUTES:
-            if self.get(attribute) == 'currentColor':
+            if dict.get(self, attribute) == 'currentColor':
                 self[attribute] = self.get('color', 'black')
 
         # Replace inherit by the parent value
         for attribute in [
-                attribute for attribute in self
-                if self[attribute] == 'inherit']:
+                attribute for attribute, value in dict.items(self)
+                if value == 'inherit']:
             if parent is not None and attribute in parent:
                 self[attribute] = parent.get(attribute)
             else:
                 del self[attribute]
 
+        # Path data parsed when the document was compiled
+        if self.tag == 'path':
+            path_data = COMPILED_PATH_DATA.get(node)
+            if path_data is not None:
+                self.path_data = path_data
+
         # Manage text by creating children
         if self.tag in ('text', 'textPath', 'a'):
             self.children, _ = self.text_children(
@@ -230,14 +304,200 @@ class Node(dict):
                      unsafe=self.unsafe)
                 for child in parent.children]
         elif not self.children:
-            self.children = []
-            for child in element.iter_children():
-                if match_features(child.etree_element):
-                    self.children.append(
-                        Node(child, style, self.url_fetcher, parent=self,
-                             unsafe=self.unsafe))
-                    if self.tag == 'switch':
-                        break
+            if self.lazy:
+                # Children are created when they are first needed
+                self._children = None
+            else:
+                self.build_children()
+
+    @property
+    def children(self):
+        if self._children is None:
+            self.build_children()
+        return self._children
+
+    @children.setter
+    def children(self, children):
+        self._children = children
+
+    def __missing__(self, key):
+        if self.inherited is not None and key in self.inherited:
+            return self.inherited[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or (
+            self.inherited is not None and key in self.inherited)
+
+    def __iter__(self):
+        return iter(self.flatten())
+
+    def __len__(self):
+        return len(self.flatten())
+
+    def __setitem__(self, key, value):
+        if self._children is None:
+            self.build_children()
+        self.reset(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self.materialize(key)
+        dict.__delitem__(self, key)
+
+    def get(self, key, default=None):
+        value = dict.get(self, key, MISSING)
+        if value is MISSING:
+            if self.inherited is None:
+                return default
+            return self.inherited.get(key, default)
+        return value
+
+    def keys(self):
+        return self.flatten().keys()
+
+    def values(self):
+        return self.flatten().values()
+
+    def items(self):
+        return self.flatten().items()
+
+    def copy(self):
+        return self.flatten()
+
+    def pop(self, key, *default):
+        self.materialize(key)
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        self.materialize()
+        return dict.popitem(self)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        if self._children is None:
+            self.build_children()
+        self.reset()
+        dict.update(self, *args, **kwargs)
+
+    def clear(self):
+        if self._children is None:
+            self.build_children()
+        self.reset()
+        self.inherited = None
+        dict.clear(self)
+
+    def reset(self, key=None):
+        """Reset the data computed from the properties of the node.
+
+        If ``key`` is given, keep the geometry when it is a property computed
+        when drawing.
+
+        """
+        self.layer = self.plan = None
+        if key not in COMPUTED_PROPERTIES:
+            self.path_data = self.vertices = self.points_bounding_box = None
+
+    def flatten(self):
+        """Return a new dict with local and inherited properties."""
+        flattened = dict(self.inherited or ())
+        flattened.update(dict.items(self))
+        return flattened
+
+    def inheritable_layer(self):
+        """Return the dict of properties inherited by the children.
+
+        The dict is shared by all the children and must not be modified. It
+        is built again when the properties of the node are modified.
+
+        """
+        if self.layer is None:
+            properties = [
+                (key, value) for key, value in dict.items(self)
+                if key not in NOT_INHERITED_ATTRIBUTES]
+            if properties:
+                self.layer = dict(self.inherited or ())
+                self.layer.update(properties)
+            else:
+                # Nothing to inherit from this node, share the parent layer
+                self.layer = self.inherited
+        return self.layer
+
+    def materialize(self, key=None):
+        """Copy inherited properties into the node, needed before deletions.
+
+        If ``key`` is given, copy only when it is an inherited property.
+
+        """
+        if self._children is None:
+            self.build_children()
+        self.reset(key)
+        if self.inherited is not None:
+            if key is None or key in self.inherited:
+                inherited, self.inherited = self.inherited, None
+                for inherited_key, value in inherited.items():
+                    dict.setdefault(self, inherited_key, value)
+
+    def clone(self, parent=None):
+        """Return a copy of the node and of its children.
+
+        XML elements and inherited properties are shared with the copy, that
+        can be drawn without modifying the original node. The copy keeps a
+        reference to the original node in its ``original`` attribute.
+
+        """
+        node = dict.__new__(type(self))
+        dict.update(node, dict.items(self))
+        for name in Node.__slots__:
+            # Spatial indexes are only stored in original nodes
+            if hasattr(self, name) and name != 'spatial_index':
+                setattr(node, name, getattr(self, name))
+        if self.original is None:
+            node.original = self
+        node.parent = parent
+        node.layer = None
+        if self._children:
+            node._children = [
+                child.clone(node if child.parent is self else child.parent)
+                for child in self._children]
+        return node
+
+    def build_children(self):
+        """Create the children nodes from the children XML elements.
+
+        The children of lazy nodes are built when they are first needed. The
+        node is not modified before, children inherit its original properties.
+
+        """
+        self._children = []
+        for child in self.element.iter_children():
+            if match_features(child.etree_element):
+                self._children.append(
+                    Node(child, self.style, self.url_fetcher, parent=self,
+                         unsafe=self.unsafe))
+                if self.tag == 'switch':
+                    break
+
+    def release_elements(self):
+        """Release the XML elements of the children once they are parsed.
+
+        Children of gradients and patterns keep their elements, as they are
+        used again when other gradients and patterns reference them. Children
+        not built yet by lazy nodes keep their elements too.
+
+        """
+        if self._children is None:
+            return
+        keep_elements = self.tag in (
+            'linearGradient', 'radialGradient', 'pattern')
+        for child in self._children:
+            child.release_elements()
+            if not keep_elements and child._children is not None:
+                child.element = child.xml_tree = None
 
     def fetch_url(self, url, resource_type):
         return read_url(url, self.url_fetcher, resource_type)
@@ -276,6 +536,8 @@ class Node(dict):
                 # and remove the node children.
                 child = child_tree.xml_tree
                 child.text = flatten(child)
+                # The XML tree has changed, elements have to be indexed again
+                self.get_root_parent().ids = None
                 child_element = cssselect2.ElementWrapper.from_xml_root(child)
             else:
                 child_node = Node(
@@ -312,9 +574,18 @@ class Node(dict):
     def get_href(self):
         return self.get('{http://www.w3.org/1999/xlink}href', self.get('href'))
 
+    def get_root_parent(self):
+        """Get the node at the root of the tree including this node."""
+        root_parent = self
+        while root_parent.parent is not None:
+            root_parent = root_parent.parent
+        return root_parent
+
 
 class Tree(Node):
     """SVG tree."""
+    __slots__ = ()
+
     def __new__(cls, **kwargs):
         tree_cache = kwargs.get('tree_cache')
         if tree_cache and kwargs.get('url'):
@@ -341,7 +612,12 @@ class Tree(Node):
         return super().__new__(cls)
 
     def __init__(self, **kwargs):
-        """Create the Tree from SVG ``text``."""
+        """Create the Tree from SVG ``text``.
+
+        ``element_id`` can be given with ``bytestring`` or ``file_obj`` to
+        use the element with this id as root, as done by URL fragments.
+
+        """
         bytestring = kwargs.get('bytestring')
         file_obj = kwargs.get('file_obj')
         url = kwargs.get('url')
@@ -349,9 +625,10 @@ class Tree(Node):
         parent = kwargs.get('parent')
         parent_children = kwargs.get('parent_children')
         tree_cache = kwargs.get('tree_cache')
-        element_id = None
+        element_id = kwargs.get('element_id')
 
         self.url_fetcher = kwargs.get('url_fetcher', fetch)
+        self.lazy = kwargs.get('lazy', parent.lazy if parent else False)
 
         if bytestring is not None:
             self.url = url
@@ -378,45 +655,177 @@ class Tree(Node):
         self_is_parent = (
             (parent and self.url == parent.url) or
             (url and url.startswith('#') and not self.url))
+        compiled = False
         if self_is_parent:
-            root_parent = parent
-            while root_parent.parent is not None:
-                root_parent = root_parent.parent
+            root_parent = parent.get_root_parent()
             tree = root_parent.xml_tree
+            if root_parent.ids is None:
+                root_parent.ids = ElementIds(tree)
+            ids = root_parent.ids
         else:
             if not bytestring:
                 bytestring = self.fetch_url(
                     parse_url(self.url), 'image/svg+xml')
             if bytestring.startswith(b'\x1f\x8b'):
                 bytestring = gzip.decompress(bytestring)
-            tree = ElementTree.fromstring(
-                bytestring, forbid_entities=not unsafe,
-                forbid_external=not unsafe)
+            compiled = bytestring.startswith(COMPILED_HEADER)
+            if compiled:
+                tree, ids = load_compiled_document(bytestring)
+                if not element_id:
+                    self.ids = ids
+            else:
+                tree = ElementTree.fromstring(
+                    bytestring, forbid_entities=not unsafe,
+                    forbid_external=not unsafe)
+                ids = ElementIds(tree) if element_id else None
 
         # Don’t allow fetching external files unless explicitly asked for
         if 'url_fetcher' not in kwargs and not unsafe:
             self.url_fetcher = safe_fetch
 
         self.xml_tree = tree
-        root = cssselect2.ElementWrapper.from_xml_root(tree)
-        style = parent.style if parent else css.parse_stylesheets(self, url)
+        if parent:
+            style = parent.style
+        elif compiled:
+            # CSS rules have already been applied to compiled documents
+            style = None
+        else:
+            style = css.parse_stylesheets(self, url)
         if element_id:
-            for element in root.iter_subtree():
-                if element.id == element_id:
-                    root = element
-                    self.xml_tree = element.etree_element
-                    break
-            else:
+            root = ids.get(element_id)
+            if root is None:
                 raise TypeError(
                     f'No tag with id="{element_id}" found.')
+            self.xml_tree = root.etree_element
+        elif style is None:
+            root = ElementTreeWrapper(tree)
+        else:
+            root = cssselect2.ElementWrapper.from_xml_root(tree)
         super().__init__(
             root, style, self.url_fetcher, parent, parent_children, self.url,
             unsafe)
         self.root = True
+        if kwargs.get('release_elements'):
+            self.release_elements()
         if tree_cache is not None and self.url:
             tree_cache[(self.url, self.get('id'))] = self
 
 
+def load_compiled_document(bytestring):
+    """Return the root XML element and the id index of a compiled document.
+
+    Compiled documents are created by :func:`cairosvg.compile_document`. The
+    path data they include is stored in :data:`COMPILED_PATH_DATA`.
+
+    """
+    header, _, document = bytestring.partition(b'\n')
+    version = header[len(COMPILED_HEADER):].decode()
+    if version != VERSION:
+        raise ValueError(
+            f'Document compiled by CairoSVG {version} '
+            f'cannot be loaded by CairoSVG {VERSION}.')
+
+    elements = []
+
+    def build(tag, attributes, text, tail, children, path_data=None):
+        element = Element(tag, attributes)
+        element.text, element.tail = text, tail
+        elements.append(element)
+        if path_data is not None:
+            commands, vertices = path_data
+            COMPILED_PATH_DATA[element] = PathData(tuple(
+                (operation, tuple(points)) for operation, points in commands),
+                array('d', vertices))
+        element.extend(build(*child) for child in children)
+        return element
+
+    root, ids = json.loads(document)
+    root = build(*root)
+    return root, ElementIds(root, {
+        element_id: ElementTreeWrapper(elements[index])
+        for element_id, index in ids.items()})
+
+
+class DocumentCache:
+    """LRU cache of parsed documents, shared between conversions.
+
+    Documents are identified by a hash of their content, by their URL and by
+    the options given to the parser. The least recently used documents are
+    removed when the total number of XML elements in the cached documents,
+    giving their number of nodes, exceeds ``max_nodes``.
+
+    """
+    def __init__(self, max_nodes=256 * 1024):
+        self.max_nodes = max_nodes
+        self.nodes = 0
+        self.hits = self.misses = 0
+        self.documents = OrderedDict()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def clear(self):
+        self.documents.clear()
+        self.nodes = 0
+
+    def get_tree(self, bytestring=None, file_obj=None, url=None, prepare=None,
+                 **kwargs):
+        """Return a new tree, parsed or copied from a cached tree.
+
+        ``prepare`` is called with parsed trees before they are cached, to
+        build data shared with their copies. Other parameters are the same as
+        :class:`Tree` parameters.
+
+        """
+        if bytestring is not None:
+            tree_kwargs = {'bytestring': bytestring, 'url': url}
+        elif file_obj is not None:
+            bytestring = file_obj.read()
+            url = getattr(file_obj, 'name', None)
+            tree_kwargs = {
+                'bytestring': bytestring,
+                'url': None if url == '<stdin>' else url}
+        elif url is not None:
+            # The document is fetched to check that its content has not
+            # changed, the tree is created from its content with the fragment
+            # of the URL
+            parsed_url = parse_url(url)
+            document_url = urlunparse(parsed_url[:-1] + ('',))
+            bytestring = read_url(
+                parse_url(document_url), kwargs.get('url_fetcher', fetch),
+                'image/svg+xml')
+            tree_kwargs = {
+                'bytestring': bytestring, 'url': document_url or None,
+                'element_id': parsed_url.fragment or None}
+        else:
+            raise TypeError(
+                'No input. Use one of bytestring, file_obj or url.')
+        if isinstance(bytestring, str):
+            bytestring = bytestring.encode()
+
+        key = (
+            sha256(bytestring).digest(), tree_kwargs['url'],
+            tree_kwargs.get('element_id'), tuple(sorted(kwargs.items())))
+        if key in self.documents:
+            self.hits += 1
+            self.documents.move_to_end(key)
+            return self.documents[key][1].clone()
+
+        # Cached trees are never drawn, as drawing modifies nodes
+        self.misses += 1
+        tree = Tree(**tree_kwargs, **kwargs)
+        nodes = sum(1 for _ in tree.xml_tree.iter())
+        if nodes <= self.max_nodes:
+            if prepare is not None:
+                prepare(tree)
+            self.documents[key] = (nodes, tree)
+            self.nodes += nodes
+            while self.nodes > self.max_nodes:
+                old_nodes, _ = self.documents.popitem(last=False)[1]
+                self.nodes -= old_nodes
+        return tree.clone()
+
+
 CASE_SENSITIVE_STYLE_METHODS = {
     'id': normalize_noop_style_declaration,
     'class': normalize_noop_style_declaration,
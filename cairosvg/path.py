@@ -3,17 +3,45 @@ Paths manager.
 
 """
 
-from math import copysign, hypot, pi, radians
+import re
+from array import array
+from collections import OrderedDict
+from math import ceil, copysign, cos, hypot, isnan, nan, pi, radians, sin, tan
+from sys import getsizeof
 
 from .bounding_box import calculate_bounding_box
 from .helpers import (
-    PATH_LETTERS, clip_marker_box, node_format, normalize, point, point_angle,
-    preserve_ratio, quadratic_points, rotate, size)
+    PATH_ARC, PATH_LETTERS, PathData, PointError, clip_marker_box, node_format,
+    path_commands, point_angle, preserve_ratio, quadratic_points, rotate,
+    simplify_path, size)
+from .surface import cairo
 from .url import parse_url
 
+PATH_MOVE_TO = cairo.PATH_MOVE_TO
+PATH_LINE_TO = cairo.PATH_LINE_TO
+PATH_CURVE_TO = cairo.PATH_CURVE_TO
+PATH_CLOSE_PATH = cairo.PATH_CLOSE_PATH
+
+# Angles stored in vertices at the end of subpaths
+SUBPATH_END = nan, nan
+
+# Path data with other characters may include units, parsed data then depends
+# on the surface and is not cached
+CACHEABLE_PATH_DATA = re.compile(rf'[\d\s,.+\-eE{PATH_LETTERS}]*')
+
+# Set to a PathCache instance to share parsed path data between documents
+PATH_CACHE = None
+
 
 def draw_markers(surface, node):
-    """Draw the markers attached to a path ``node``."""
+    """Draw the markers attached to a path ``node``.
+
+    The vertices of the node are stored in a flat array of floats, alternating
+    the ``(x, y)`` coordinates of the points and the tangent angles before and
+    after these points. :data:`SUBPATH_END` replaces the angles at the end of
+    subpaths.
+
+    """
     if not getattr(node, 'vertices', None):
         return
 
@@ -26,13 +54,31 @@ def draw_markers(surface, node):
         else:
             markers[position] = common_marker
 
+    if not any(markers.values()):
+        return
+
+    # Markers are recorded with the linear part of the transformation matrix,
+    # translations and rotations of vertices are applied when painting
+    xx, yx, xy, yy, _, _ = surface.context.get_matrix().as_tuple()
+    matrix = cairo.Matrix(xx, yx, xy, yy)
+    inverse_matrix = cairo.Matrix(xx, yx, xy, yy)
+    try:
+        inverse_matrix.invert()
+    except cairo.Error:
+        return
+    recordings = {}
+
     angle1, angle2 = None, None
     position = 'start'
 
-    while node.vertices:
+    vertices = node.vertices
+    for i in range(0, len(vertices), 4):
         # Calculate position and angle
-        point = node.vertices.pop(0)
-        angles = node.vertices.pop(0) if node.vertices else None
+        point = vertices[i], vertices[i + 1]
+        if i + 2 < len(vertices) and not isnan(vertices[i + 2]):
+            angles = vertices[i + 2], vertices[i + 3]
+        else:
+            angles = None
         if angles:
             if position == 'start':
                 angle = pi - angles[0]
@@ -47,43 +93,9 @@ def draw_markers(surface, node):
         marker = markers[position]
         if marker:
             marker_node = surface.markers.get(marker)
-
-            # Calculate scale based on current stroke (if requested)
-            if marker_node.get('markerUnits') == 'userSpaceOnUse':
-                scale = 1
-            else:
-                scale = size(
-                    surface, surface.parent_node.get('stroke-width', '1'))
-
-            # Calculate position, (additional) scale and clipping based on
-            # marker properties
-            viewbox = node_format(surface, marker_node)[2]
-            if viewbox:
-                scale_x, scale_y, translate_x, translate_y = preserve_ratio(
-                    surface, marker_node)
-                clip_box = clip_marker_box(
-                    surface, marker_node, scale_x, scale_y)
-            else:
-                # Calculate sizes
-                marker_width = size(surface,
-                                    marker_node.get('markerWidth', '3'), 'x')
-                marker_height = size(surface,
-                                     marker_node.get('markerHeight', '3'), 'y')
-                bounding_box = calculate_bounding_box(surface, marker_node)
-
-                # Calculate position and scale (preserve aspect ratio)
-                translate_x = -size(surface, marker_node.get('refX', '0'), 'x')
-                translate_y = -size(surface, marker_node.get('refY', '0'), 'y')
-                scale_x = scale_y = min(
-                    marker_width / bounding_box[2],
-                    marker_height / bounding_box[3])
-
-                # No clipping since viewbox is not present
-                clip_box = None
-
-            # Add extra path for marker
-            temp_path = surface.context.copy_path()
-            surface.context.new_path()
+            if marker not in recordings:
+                recordings[marker] = record_marker(
+                    surface, marker_node, matrix)
 
             # Override angle (if requested)
             node_angle = marker_node.get('orient', '0')
@@ -92,361 +104,537 @@ def draw_markers(surface, node):
             elif node_angle == 'auto-start-reverse' and position == 'start':
                 angle += radians(180)
 
-            # Draw marker path
+            # Paint marker
             # See http://www.w3.org/TR/SVG/painting.html#MarkerAlgorithm
-            for child in marker_node.children:
-                surface.context.save()
-                surface.context.translate(*point)
-                surface.context.rotate(angle)
-                surface.context.scale(scale)
-                surface.context.scale(scale_x, scale_y)
-                surface.context.translate(translate_x, translate_y)
-
-                # Add clipping (if present and requested)
-                overflow = marker_node.get('overflow', 'hidden')
-                if clip_box and overflow in ('hidden', 'scroll'):
-                    surface.context.save()
-                    surface.context.rectangle(*clip_box)
-                    surface.context.restore()
-                    surface.context.clip()
-
-                surface.draw(child)
-                surface.context.restore()
-
-            surface.context.append_path(temp_path)
+            surface.context.save()
+            surface.context.translate(*point)
+            surface.context.rotate(angle)
+            surface.context.transform(inverse_matrix)
+            surface.context.set_source_surface(recordings[marker])
+            surface.context.paint()
+            surface.context.restore()
 
         position = 'mid' if angles else 'start'
 
 
-def path(surface, node):
-    """Draw a path ``node``."""
-    string = node.get('d', '')
+def record_marker(surface, marker_node, matrix):
+    """Record the drawing of ``marker_node`` with the given ``matrix``.
 
-    node.vertices = []
-
-    for letter in PATH_LETTERS:
-        string = string.replace(letter, f' {letter} ')
+    Return a cairo recording surface that can be painted on each vertex.
 
+    """
+    # Calculate scale based on current stroke (if requested)
+    if marker_node.get('markerUnits') == 'userSpaceOnUse':
+        scale = 1
+    else:
+        scale = size(surface, surface.parent_node.get('stroke-width', '1'))
+
+    # Calculate position, (additional) scale and clipping based on marker
+    # properties
+    viewbox = node_format(surface, marker_node)[2]
+    if viewbox:
+        scale_x, scale_y, translate_x, translate_y = preserve_ratio(
+            surface, marker_node)
+        clip_box = clip_marker_box(surface, marker_node, scale_x, scale_y)
+    else:
+        # Calculate sizes
+        marker_width = size(surface, marker_node.get('markerWidth', '3'), 'x')
+        marker_height = size(
+            surface, marker_node.get('markerHeight', '3'), 'y')
+        bounding_box = calculate_bounding_box(surface, marker_node)
+
+        # Calculate position and scale (preserve aspect ratio)
+        translate_x = -size(surface, marker_node.get('refX', '0'), 'x')
+        translate_y = -size(surface, marker_node.get('refY', '0'), 'y')
+        scale_x = scale_y = min(
+            marker_width / bounding_box[2], marker_height / bounding_box[3])
+
+        # No clipping since viewbox is not present
+        clip_box = None
+
+    # Marker children inherit the drawing state, as for other nodes
+    context = surface.context
+    recording = cairo.RecordingSurface(cairo.CONTENT_COLOR_ALPHA, None)
+    marker_context = cairo.Context(recording)
+    marker_context.set_matrix(matrix)
+    marker_context.set_line_cap(context.get_line_cap())
+    marker_context.set_line_join(context.get_line_join())
+    marker_context.set_dash(*context.get_dash())
+    marker_context.set_fill_rule(context.get_fill_rule())
+    marker_context.set_tolerance(context.get_tolerance())
+    marker_context.set_miter_limit(context.get_miter_limit())
+    marker_context.set_antialias(context.get_antialias())
+    marker_context.set_font_options(context.get_font_options())
+
+    surface.context = marker_context
+    try:
+        for child in marker_node.children:
+            marker_context.save()
+            marker_context.scale(scale)
+            marker_context.scale(scale_x, scale_y)
+            marker_context.translate(translate_x, translate_y)
+
+            # Add clipping (if present and requested)
+            overflow = marker_node.get('overflow', 'hidden')
+            if clip_box and overflow in ('hidden', 'scroll'):
+                marker_context.save()
+                marker_context.rectangle(*clip_box)
+                marker_context.restore()
+                marker_context.clip()
+
+            surface.draw(child)
+            marker_context.restore()
+    finally:
+        surface.context = context
+
+    return recording
+
+
+def parse_path(surface, string):
+    """Parse the path data ``string`` into :class:`PathData`."""
+    commands = []
+    vertices = array('d')
     last_letter = None
-    string = normalize(string)
 
     # Keep the current point because Cairo's get_current_point is not accurate
     # enough. See https://github.com/Kozea/CairoSVG/issues/111.
-    if surface.context.has_current_point():
-        current_point = surface.context.get_current_point()
-    else:
-        surface.context.move_to(0, 0)
-        current_point = 0, 0
+    current_point = 0, 0
 
-    while string:
-        string = string.strip()
-        if string.split(' ', 1)[0] in PATH_LETTERS:
-            letter, string = (string + ' ').split(' ', 1)
+    # Path data is rendered up to the first error, see
+    # https://www.w3.org/TR/SVG/paths.html#PathDataErrorHandling
+    try:
+        for letter, values in path_commands(surface, string):
             if last_letter in (None, 'z', 'Z') and letter not in 'mM':
-                node.vertices.append(current_point)
+                vertices.extend(current_point)
                 first_path_point = current_point
-        elif letter == 'M':
-            letter = 'L'
-        elif letter == 'm':
-            letter = 'l'
-
-        if last_letter in (None, 'm', 'M', 'z', 'Z'):
-            first_path_point = None
-        if letter not in (None, 'm', 'M', 'z', 'Z') and (
-                first_path_point is None):
-            first_path_point = current_point
-
-        if letter in 'aA':
-            # Elliptic curve
-            surface.context.set_tolerance(0.00001)
-            x1, y1 = current_point
-            rx, ry, string = point(surface, string)
-            rotation, string = string.split(' ', 1)
-            rotation = radians(float(rotation))
-
-            # The large and sweep values are not always separated from the
-            # following values. These flags can only be 0 or 1, so reading a
-            # single digit suffices.
-            large, string = string[0], string[1:].strip()
-            sweep, string = string[0], string[1:].strip()
-
-            # Retrieve end point and set remainder (before checking flags)
-            x3, y3, string = point(surface, string)
-
-            # Only allow 0 or 1 for flags
-            large, sweep = int(large), int(sweep)
-            if large not in (0, 1) or sweep not in (0, 1):
-                continue
-            large, sweep = bool(large), bool(sweep)
-
-            if letter == 'A':
-                # Absolute x3 and y3, convert to relative
-                x3 -= x1
-                y3 -= y1
-
-            # rx=0 or ry=0 means straight line
-            if not rx or not ry:
-                if string and string[0] not in PATH_LETTERS:
-                    # As we replace the current operation by l, we must be sure
-                    # that the next letter is set to the real current letter (a
-                    # or A) in case it’s omitted
-                    next_letter = f'{letter} '
-                else:
-                    next_letter = ''
-                string = f'l {x3} {y3} {next_letter}{string}'
-                continue
-
-            radii_ratio = ry / rx
-
-            # Cancel the rotation of the second point
-            xe, ye = rotate(x3, y3, -rotation)
-            ye /= radii_ratio
-
-            # Find the angle between the second point and the x axis
-            angle = point_angle(0, 0, xe, ye)
-
-            # Put the second point onto the x axis
-            xe = hypot(xe, ye)
-            ye = 0
-
-            # Update the x radius if it is too small
-            rx = max(rx, xe / 2)
-
-            # Find one circle centre
-            xc = xe / 2
-            yc = (rx ** 2 - xc ** 2) ** .5
-
-            # Choose between the two circles according to flags
-            if not (large ^ sweep):
-                yc = -yc
-
-            # Define the arc sweep
-            arc = (
-                surface.context.arc if sweep else surface.context.arc_negative)
-
-            # Put the second point and the center back to their positions
-            xe, ye = rotate(xe, 0, angle)
-            xc, yc = rotate(xc, yc, angle)
-
-            # Find the drawing angles
-            angle1 = point_angle(xc, yc, 0, 0)
-            angle2 = point_angle(xc, yc, xe, ye)
-
-            # Store the tangent angles
-            node.vertices.append((-angle1, -angle2))
-
-            # Draw the arc
-            surface.context.save()
-            surface.context.translate(x1, y1)
-            surface.context.rotate(rotation)
-            surface.context.scale(1, radii_ratio)
-            arc(xc, yc, rx, angle1, angle2)
-            surface.context.restore()
-            current_point = current_point[0] + x3, current_point[1] + y3
-
-        elif letter == 'c':
-            # Relative curve
-            x, y = current_point
-            x1, y1, string = point(surface, string)
-            x2, y2, string = point(surface, string)
-            x3, y3, string = point(surface, string)
-            node.vertices.append((
-                point_angle(x2, y2, x1, y1), point_angle(x2, y2, x3, y3)))
-            surface.context.rel_curve_to(x1, y1, x2, y2, x3, y3)
-            current_point = current_point[0] + x3, current_point[1] + y3
-
-            # Save absolute values for x and y, useful if next letter is s or S
-            x1 += x
-            x2 += x
-            x3 += x
-            y1 += y
-            y2 += y
-            y3 += y
-
-        elif letter == 'C':
-            # Curve
-            x1, y1, string = point(surface, string)
-            x2, y2, string = point(surface, string)
-            x3, y3, string = point(surface, string)
-            node.vertices.append((
-                point_angle(x2, y2, x1, y1), point_angle(x2, y2, x3, y3)))
-            surface.context.curve_to(x1, y1, x2, y2, x3, y3)
-            current_point = x3, y3
-
-        elif letter == 'h':
-            # Relative horizontal line
-            x, string = (string + ' ').split(' ', 1)
-            old_x, old_y = current_point
-            angle = 0 if size(surface, x, 'x') > 0 else pi
-            node.vertices.append((pi - angle, angle))
-            x = size(surface, x, 'x')
-            surface.context.rel_line_to(x, 0)
-            current_point = current_point[0] + x, current_point[1]
-
-        elif letter == 'H':
-            # Horizontal line
-            x, string = (string + ' ').split(' ', 1)
-            old_x, old_y = current_point
-            angle = 0 if size(surface, x, 'x') > old_x else pi
-            node.vertices.append((pi - angle, angle))
-            x = size(surface, x, 'x')
-            surface.context.line_to(x, old_y)
-            current_point = x, current_point[1]
-
-        elif letter == 'l':
-            # Relative straight line
-            x, y, string = point(surface, string)
-            angle = point_angle(0, 0, x, y)
-            node.vertices.append((pi - angle, angle))
-            surface.context.rel_line_to(x, y)
-            current_point = current_point[0] + x, current_point[1] + y
-
-        elif letter == 'L':
-            # Straight line
-            x, y, string = point(surface, string)
-            old_x, old_y = current_point
-            angle = point_angle(old_x, old_y, x, y)
-            node.vertices.append((pi - angle, angle))
-            surface.context.line_to(x, y)
-            current_point = x, y
-
-        elif letter == 'm':
-            # Current point relative move
-            x, y, string = point(surface, string)
-            if last_letter and last_letter not in 'zZ':
-                node.vertices.append(None)
-            surface.context.rel_move_to(x, y)
-            current_point = current_point[0] + x, current_point[1] + y
-
-        elif letter == 'M':
-            # Current point move
-            x, y, string = point(surface, string)
-            if last_letter and last_letter not in 'zZ':
-                node.vertices.append(None)
-            surface.context.move_to(x, y)
-            current_point = x, y
-
-        elif letter == 'q':
-            # Relative quadratic curve
-            x1, y1 = 0, 0
-            x2, y2, string = point(surface, string)
-            x3, y3, string = point(surface, string)
-            xq1, yq1, xq2, yq2, xq3, yq3 = quadratic_points(
-                x1, y1, x2, y2, x3, y3)
-            surface.context.rel_curve_to(xq1, yq1, xq2, yq2, xq3, yq3)
-            node.vertices.append((0, 0))
-            current_point = current_point[0] + x3, current_point[1] + y3
-
-        elif letter == 'Q':
-            # Quadratic curve
-            x1, y1 = current_point
-            x2, y2, string = point(surface, string)
-            x3, y3, string = point(surface, string)
-            xq1, yq1, xq2, yq2, xq3, yq3 = quadratic_points(
-                x1, y1, x2, y2, x3, y3)
-            surface.context.curve_to(xq1, yq1, xq2, yq2, xq3, yq3)
-            node.vertices.append((0, 0))
-            current_point = x3, y3
-
-        elif letter == 's':
-            # Relative smooth curve
-            x, y = current_point
-            x1 = x3 - x2 if last_letter in 'csCS' else 0
-            y1 = y3 - y2 if last_letter in 'csCS' else 0
-            x2, y2, string = point(surface, string)
-            x3, y3, string = point(surface, string)
-            node.vertices.append((
-                point_angle(x2, y2, x1, y1), point_angle(x2, y2, x3, y3)))
-            surface.context.rel_curve_to(x1, y1, x2, y2, x3, y3)
-            current_point = current_point[0] + x3, current_point[1] + y3
-
-            # Save absolute values for x and y, useful if next letter is s or S
-            x1 += x
-            x2 += x
-            x3 += x
-            y1 += y
-            y2 += y
-            y3 += y
-
-        elif letter == 'S':
-            # Smooth curve
-            x, y = current_point
-            x1 = x3 + (x3 - x2) if last_letter in 'csCS' else x
-            y1 = y3 + (y3 - y2) if last_letter in 'csCS' else y
-            x2, y2, string = point(surface, string)
-            x3, y3, string = point(surface, string)
-            node.vertices.append((
-                point_angle(x2, y2, x1, y1), point_angle(x2, y2, x3, y3)))
-            surface.context.curve_to(x1, y1, x2, y2, x3, y3)
-            current_point = x3, y3
-
-        elif letter == 't':
-            # Relative quadratic curve end
-            if last_letter not in 'QqTt':
-                x2, y2, x3, y3 = 0, 0, 0, 0
-            elif last_letter in 'QT':
-                x2 -= x1
-                y2 -= y1
-                x3 -= x1
-                y3 -= y1
-            x2 = x3 - x2
-            y2 = y3 - y2
-            x1, y1 = 0, 0
-            x3, y3, string = point(surface, string)
-            xq1, yq1, xq2, yq2, xq3, yq3 = quadratic_points(
-                x1, y1, x2, y2, x3, y3)
-            node.vertices.append((0, 0))
-            surface.context.rel_curve_to(xq1, yq1, xq2, yq2, xq3, yq3)
-            current_point = current_point[0] + x3, current_point[1] + y3
-
-        elif letter == 'T':
-            # Quadratic curve end
-            abs_x, abs_y = current_point
-            if last_letter not in 'QqTt':
-                x2, y2, x3, y3 = abs_x, abs_y, abs_x, abs_y
-            elif last_letter in 'qt':
-                x2 += abs_x
-                y2 += abs_y
-                x3 += abs_x
-                y3 += abs_y
-            x2 = abs_x + (x3 - x2)
-            y2 = abs_y + (y3 - y2)
-            x1, y1 = abs_x, abs_y
-            x3, y3, string = point(surface, string)
-            xq1, yq1, xq2, yq2, xq3, yq3 = quadratic_points(
-                x1, y1, x2, y2, x3, y3)
-            node.vertices.append((0, 0))
-            surface.context.curve_to(xq1, yq1, xq2, yq2, xq3, yq3)
-            current_point = x3, y3
-
-        elif letter == 'v':
-            # Relative vertical line
-            y, string = (string + ' ').split(' ', 1)
-            old_x, old_y = current_point
-            angle = copysign(pi / 2, size(surface, y, 'y'))
-            node.vertices.append((-angle, angle))
-            y = size(surface, y, 'y')
-            surface.context.rel_line_to(0, y)
-            current_point = current_point[0], current_point[1] + y
-
-        elif letter == 'V':
-            # Vertical line
-            y, string = (string + ' ').split(' ', 1)
-            old_x, old_y = current_point
-            angle = copysign(pi / 2, size(surface, y, 'y') - old_y)
-            node.vertices.append((-angle, angle))
-            y = size(surface, y, 'y')
-            surface.context.line_to(old_x, y)
-            current_point = current_point[0], y
-
-        elif letter in 'zZ' and first_path_point:
-            # End of path
-            node.vertices.append(None)
-            surface.context.close_path()
-            current_point = first_path_point
-
-        if letter not in 'zZ':
-            node.vertices.append(current_point)
-
-        string = string.strip()
-        last_letter = letter
+            if last_letter in (None, 'm', 'M', 'z', 'Z'):
+                first_path_point = None
+            if letter not in 'mMzZ' and first_path_point is None:
+                first_path_point = current_point
+
+            if letter in 'aA':
+                # Elliptic curve
+                x1, y1 = current_point
+                rx, ry, rotation, large, sweep, x3, y3 = values
+                rotation = radians(rotation)
+
+                # Only allow 0 or 1 for flags
+                if large not in (0, 1) or sweep not in (0, 1):
+                    continue
+                large, sweep = bool(large), bool(sweep)
+
+                if letter == 'A':
+                    # Absolute x3 and y3, convert to relative
+                    x3 -= x1
+                    y3 -= y1
+
+                # rx=0 or ry=0 means straight line
+                if not rx or not ry:
+                    # The curve is replaced by a relative straight line,
+                    # following the same rules as an explicit l command
+                    if last_letter in (None, 'z', 'Z'):
+                        vertices.extend(current_point)
+                        first_path_point = current_point
+                    if last_letter in (None, 'm', 'M', 'z', 'Z'):
+                        first_path_point = None
+                    if first_path_point is None:
+                        first_path_point = current_point
+                    letter, values = 'l', (x3, y3)
+
+            if letter in 'aA':
+                radii_ratio = ry / rx
+
+                # Cancel the rotation of the second point
+                xe, ye = rotate(x3, y3, -rotation)
+                ye /= radii_ratio
+
+                # Find the angle between the second point and the x axis
+                angle = point_angle(0, 0, xe, ye)
+
+                # Put the second point onto the x axis
+                xe = hypot(xe, ye)
+                ye = 0
+
+                # Update the x radius if it is too small
+                rx = max(rx, xe / 2)
+
+                # Find one circle centre
+                xc = xe / 2
+                yc = (rx ** 2 - xc ** 2) ** .5
+
+                # Choose between the two circles according to flags
+                if not (large ^ sweep):
+                    yc = -yc
+
+                # Put the second point and the center back to their positions
+                xe, ye = rotate(xe, 0, angle)
+                xc, yc = rotate(xc, yc, angle)
+
+                # Find the drawing angles
+                angle1 = point_angle(xc, yc, 0, 0)
+                angle2 = point_angle(xc, yc, xe, ye)
+
+                # Store the tangent angles
+                vertices.extend((-angle1, -angle2))
+
+                # Store the arc, with the center of the ellipse in user space
+                # and the angles in the drawing direction
+                if sweep and angle2 < angle1:
+                    angle2 += 2 * pi
+                elif not sweep and angle2 > angle1:
+                    angle2 -= 2 * pi
+                xc, yc = rotate(xc, yc * radii_ratio, rotation)
+                commands.append((PATH_ARC, (
+                    x1 + xc, y1 + yc, rx, rx * radii_ratio, rotation,
+                    angle1, angle2)))
+                current_point = (
+                    current_point[0] + x3, current_point[1] + y3)
+
+            elif letter == 'c':
+                # Relative curve
+                x, y = current_point
+                x1, y1, x2, y2, x3, y3 = values
+                vertices.extend((
+                    point_angle(x2, y2, x1, y1), point_angle(x2, y2, x3, y3)))
+
+                # Save absolute values for x and y, useful if next letter is s
+                # or S
+                x1 += x
+                x2 += x
+                x3 += x
+                y1 += y
+                y2 += y
+                y3 += y
+                commands.append((PATH_CURVE_TO, (x1, y1, x2, y2, x3, y3)))
+                current_point = x3, y3
+
+            elif letter == 'C':
+                # Curve
+                x1, y1, x2, y2, x3, y3 = values
+                vertices.extend((
+                    point_angle(x2, y2, x1, y1), point_angle(x2, y2, x3, y3)))
+                commands.append((PATH_CURVE_TO, values))
+                current_point = x3, y3
+
+            elif letter == 'h':
+                # Relative horizontal line
+                x = values[0]
+                old_x, old_y = current_point
+                angle = 0 if x > 0 else pi
+                vertices.extend((pi - angle, angle))
+                current_point = old_x + x, old_y
+                commands.append((PATH_LINE_TO, current_point))
+
+            elif letter == 'H':
+                # Horizontal line
+                x = values[0]
+                old_x, old_y = current_point
+                angle = 0 if x > old_x else pi
+                vertices.extend((pi - angle, angle))
+                current_point = x, old_y
+                commands.append((PATH_LINE_TO, current_point))
+
+            elif letter == 'l':
+                # Relative straight line
+                x, y = values
+                angle = point_angle(0, 0, x, y)
+                vertices.extend((pi - angle, angle))
+                current_point = current_point[0] + x, current_point[1] + y
+                commands.append((PATH_LINE_TO, current_point))
+
+            elif letter == 'L':
+                # Straight line
+                x, y = values
+                old_x, old_y = current_point
+                angle = point_angle(old_x, old_y, x, y)
+                vertices.extend((pi - angle, angle))
+                current_point = x, y
+                commands.append((PATH_LINE_TO, current_point))
+
+            elif letter == 'm':
+                # Current point relative move
+                x, y = values
+                if last_letter and last_letter not in 'zZ':
+                    vertices.extend(SUBPATH_END)
+                current_point = current_point[0] + x, current_point[1] + y
+                commands.append((PATH_MOVE_TO, current_point))
+
+            elif letter == 'M':
+                # Current point move
+                x, y = values
+                if last_letter and last_letter not in 'zZ':
+                    vertices.extend(SUBPATH_END)
+                current_point = x, y
+                commands.append((PATH_MOVE_TO, current_point))
+
+            elif letter == 'q':
+                # Relative quadratic curve
+                x, y = current_point
+                x1, y1 = 0, 0
+                x2, y2, x3, y3 = values
+                xq1, yq1, xq2, yq2, xq3, yq3 = quadratic_points(
+                    x1, y1, x2, y2, x3, y3)
+                commands.append((PATH_CURVE_TO, (
+                    x + xq1, y + yq1, x + xq2, y + yq2, x + xq3, y + yq3)))
+                vertices.extend((0, 0))
+                current_point = x + x3, y + y3
+
+            elif letter == 'Q':
+                # Quadratic curve
+                x1, y1 = current_point
+                x2, y2, x3, y3 = values
+                commands.append((PATH_CURVE_TO, quadratic_points(
+                    x1, y1, x2, y2, x3, y3)))
+                vertices.extend((0, 0))
+                current_point = x3, y3
+
+            elif letter == 's':
+                # Relative smooth curve
+                x, y = current_point
+                x1 = x3 - x2 if last_letter in 'csCS' else 0
+                y1 = y3 - y2 if last_letter in 'csCS' else 0
+                x2, y2, x3, y3 = values
+                vertices.extend((
+                    point_angle(x2, y2, x1, y1), point_angle(x2, y2, x3, y3)))
+
+                # Save absolute values for x and y, useful if next letter is s
+                # or S
+                x1 += x
+                x2 += x
+                x3 += x
+                y1 += y
+                y2 += y
+                y3 += y
+                commands.append((PATH_CURVE_TO, (x1, y1, x2, y2, x3, y3)))
+                current_point = x3, y3
+
+            elif letter == 'S':
+                # Smooth curve
+                x, y = current_point
+                x1 = x3 + (x3 - x2) if last_letter in 'csCS' else x
+                y1 = y3 + (y3 - y2) if last_letter in 'csCS' else y
+                x2, y2, x3, y3 = values
+                vertices.extend((
+                    point_angle(x2, y2, x1, y1), point_angle(x2, y2, x3, y3)))
+                commands.append((PATH_CURVE_TO, (x1, y1, x2, y2, x3, y3)))
+                current_point = x3, y3
+
+            elif letter == 't':
+                # Relative quadratic curve end
+                if last_letter not in 'QqTt':
+                    x2, y2, x3, y3 = 0, 0, 0, 0
+                elif last_letter in 'QT':
+                    x2 -= x1
+                    y2 -= y1
+                    x3 -= x1
+                    y3 -= y1
+                x2 = x3 - x2
+                y2 = y3 - y2
+                x1, y1 = 0, 0
+                x3, y3 = values
+                x, y = current_point
+                xq1, yq1, xq2, yq2, xq3, yq3 = quadratic_points(
+                    x1, y1, x2, y2, x3, y3)
+                vertices.extend((0, 0))
+                commands.append((PATH_CURVE_TO, (
+                    x + xq1, y + yq1, x + xq2, y + yq2, x + xq3, y + yq3)))
+                current_point = x + x3, y + y3
+
+            elif letter == 'T':
+                # Quadratic curve end
+                abs_x, abs_y = current_point
+                if last_letter not in 'QqTt':
+                    x2, y2, x3, y3 = abs_x, abs_y, abs_x, abs_y
+                elif last_letter in 'qt':
+                    x2 += abs_x
+                    y2 += abs_y
+                    x3 += abs_x
+                    y3 += abs_y
+                x2 = abs_x + (x3 - x2)
+                y2 = abs_y + (y3 - y2)
+                x1, y1 = abs_x, abs_y
+                x3, y3 = values
+                vertices.extend((0, 0))
+                commands.append((PATH_CURVE_TO, quadratic_points(
+                    x1, y1, x2, y2, x3, y3)))
+                current_point = x3, y3
+
+            elif letter == 'v':
+                # Relative vertical line
+                y = values[0]
+                old_x, old_y = current_point
+                angle = copysign(pi / 2, y)
+                vertices.extend((-angle, angle))
+                current_point = old_x, old_y + y
+                commands.append((PATH_LINE_TO, current_point))
+
+            elif letter == 'V':
+                # Vertical line
+                y = values[0]
+                old_x, old_y = current_point
+                angle = copysign(pi / 2, y - old_y)
+                vertices.extend((-angle, angle))
+                current_point = old_x, y
+                commands.append((PATH_LINE_TO, current_point))
+
+            elif letter in 'zZ' and first_path_point:
+                # End of path
+                vertices.extend(SUBPATH_END)
+                commands.append((PATH_CLOSE_PATH, ()))
+                current_point = first_path_point
+
+            if letter not in 'zZ':
+                vertices.extend(current_point)
+
+            last_letter = letter
+    except PointError:
+        pass
+
+    return PathData(tuple(commands), vertices)
+
+
+class PathCache:
+    """LRU cache of parsed path data, shared between documents.
+
+    Path data is identified by its ``d`` string. The least recently used path
+    data is removed when the approximate total size of the cached data exceeds
+    ``max_size`` bytes.
+
+    """
+    def __init__(self, max_size=16 * 1024 * 1024):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = self.misses = 0
+        self.paths = OrderedDict()
+
+    def __len__(self):
+        return len(self.paths)
+
+    @property
+    def hit_rate(self):
+        """Ratio of the path data found in cache."""
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0
+
+    def clear(self):
+        self.paths.clear()
+        self.size = 0
+
+    def get_path_data(self, surface, string):
+        """Return :class:`PathData`, parsed or found in cache."""
+        if string in self.paths:
+            self.hits += 1
+            self.paths.move_to_end(string)
+            return self.paths[string][1]
+
+        self.misses += 1
+        data = parse_path(surface, string)
+        if CACHEABLE_PATH_DATA.fullmatch(string):
+            size = getsizeof(string) + path_data_size(data)
+            if size <= self.max_size:
+                self.paths[string] = (size, data)
+                self.size += size
+                while self.size > self.max_size:
+                    old_size, _ = self.paths.popitem(last=False)[1]
+                    self.size -= old_size
+        return data
+
+
+def path_data_size(data):
+    """Get the approximate size in bytes of :class:`PathData`."""
+    float_size = getsizeof(0.)
+    size = (
+        getsizeof(data) + getsizeof(data.commands) +
+        getsizeof(data.vertices))
+    for command in data.commands:
+        size += (
+            getsizeof(command) + getsizeof(command[1]) +
+            float_size * len(command[1]))
+    return size
+
+
+def path_data(surface, node):
+    """Get the :class:`PathData` of a path ``node``.
+
+    Path data is parsed when first needed and stored in the node. It's shared
+    with other nodes if :data:`PATH_CACHE` is set.
+
+    """
+    data = getattr(node, 'path_data', None)
+    if data is None:
+        string = node.get('d', '')
+        if PATH_CACHE is None:
+            data = parse_path(surface, string)
+        else:
+            data = PATH_CACHE.get_path_data(surface, string)
+        node.path_data = data
+    return data
+
+
+def arc_curves(cx, cy, rx, ry, rotation, angle1, angle2, segments):
+    """Get the ``segments`` Bézier curves approximating an elliptical arc."""
+    cos_rotation, sin_rotation = cos(rotation), sin(rotation)
+    step = (angle2 - angle1) / segments
+    # Length of the tangents for an arc of unit circle
+    tangent = 4 / 3 * tan(step / 4)
+    for i in range(segments):
+        angle = angle1 + i * step
+        cos1, sin1 = cos(angle), sin(angle)
+        cos2, sin2 = cos(angle + step), sin(angle + step)
+        points = (
+            (cos1 - tangent * sin1, sin1 + tangent * cos1),
+            (cos2 + tangent * sin2, sin2 - tangent * cos2),
+            (cos2, sin2))
+        yield PATH_CURVE_TO, tuple(
+            coordinate for x, y in points for coordinate in (
+                cx + rx * x * cos_rotation - ry * y * sin_rotation,
+                cy + rx * x * sin_rotation + ry * y * cos_rotation))
+
+
+def arc_segments(radius, angle, tolerance):
+    """Get the number of Bézier curves needed to draw an arc of circle.
+
+    The distance between the arc and its curves is lower than ``tolerance``.
+    As in cairo, the error of a curve drawing an arc of unit circle of angle θ
+    is 2 / 27 × sin⁶(θ / 4) / cos²(θ / 4).
+
+    """
+    if radius <= tolerance:
+        return 1
+    # Curves are never longer than a quarter of circle, sin(θ / 4) ≤ θ / 4 and
+    # cos²(θ / 4) ≥ cos²(π / 8) give the maximum angle of each curve
+    max_angle = min(pi / 2, 4 * (
+        tolerance / radius * 27 / 2 * cos(pi / 8) ** 2) ** (1 / 6))
+    return max(1, ceil(abs(angle) / max_angle))
+
+
+def append_path_data(surface, data):
+    """Append the commands of :class:`PathData` to the current path."""
+    context = surface.context
+    if not context.has_current_point():
+        context.move_to(0, 0)
+    commands = data.commands
+    if data.arcs:
+        # Arcs are split into as many curves as needed for the tolerance
+        # used by cairo to draw curves, given in device units
+        tolerance = context.get_tolerance()
+        scale = max(
+            hypot(*context.user_to_device_distance(1, 0)),
+            hypot(*context.user_to_device_distance(0, 1)))
+        commands = []
+        for operation, points in data.commands:
+            if operation == PATH_ARC:
+                cx, cy, rx, ry, rotation, angle1, angle2 = points
+                segments = arc_segments(
+                    max(abs(rx), abs(ry)) * scale, angle2 - angle1, tolerance)
+                commands.extend(arc_curves(*points, segments))
+            else:
+                commands.append((operation, points))
+    context.append_path(simplify_path(surface, commands))
+
+
+def path(surface, node):
+    """Draw a path ``node``."""
+    data = path_data(surface, node)
+    node.vertices = data.vertices
+    append_path_data(surface, data)
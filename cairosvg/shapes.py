@@ -3,9 +3,11 @@ Shapes drawers.
 
 """
 
+from array import array
 from math import pi
 
-from .helpers import normalize, point, point_angle, size
+from .helpers import PointError, parse_points, point_angle, simplify_path, size
+from .surface import cairo
 
 
 def circle(surface, node):
@@ -47,7 +49,7 @@ def line(surface, node):
     surface.context.move_to(x1, y1)
     surface.context.line_to(x2, y2)
     angle = point_angle(x1, y1, x2, y2)
-    node.vertices = [(x1, y1), (pi - angle, angle), (x2, y2)]
+    node.vertices = array('d', (x1, y1, pi - angle, angle, x2, y2))
 
 
 def polygon(surface, node):
@@ -58,18 +60,19 @@ def polygon(surface, node):
 
 def polyline(surface, node):
     """Draw a polyline ``node``."""
-    points = normalize(node.get('points', ''))
-    if points:
-        x, y, points = point(surface, points)
-        surface.context.move_to(x, y)
-        node.vertices = [(x, y)]
-        while points:
-            x_old, y_old = x, y
-            x, y, points = point(surface, points)
+    coordinates = parse_points(surface, node.get('points', ''))
+    xs, ys = coordinates[0::2], coordinates[1::2]
+    if ys:
+        surface.context.move_to(xs[0], ys[0])
+        surface.context.append_path(simplify_path(surface, [
+            (cairo.PATH_LINE_TO, point) for point in zip(xs[1:], ys[1:])]))
+        node.vertices = array('d', (xs[0], ys[0]))
+        for x_old, y_old, x, y in zip(xs, ys, xs[1:], ys[1:]):
             angle = point_angle(x_old, y_old, x, y)
-            node.vertices.append((pi - angle, angle))
-            surface.context.line_to(x, y)
-            node.vertices.append((x, y))
+            node.vertices.extend((pi - angle, angle, x, y))
+    if len(xs) != len(ys):
+        # Odd number of coordinates, points are drawn up to the error
+        raise PointError
 
 
 def rect(surface, node):
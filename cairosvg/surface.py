@@ -3,22 +3,22 @@ Cairo surface creators.
 
 """
 
-import copy
 import io
 
 import cairocffi as cairo
 
+from .bounding_box import calculate_spatial_index, is_outside_clip
 from .colors import color, negate_color
 from .defs import (
     apply_filter_after_painting, apply_filter_before_painting, clip_path,
     filter_, gradient_or_pattern, linear_gradient, marker, mask, paint_mask,
     parse_all_defs, pattern, prepare_filter, radial_gradient, use)
 from .helpers import (
-    UNITS, PointError, clip_rect, node_format, normalize, paint,
+    UNITS, PointError, clip_rect, node_format, normalize, output_size, paint,
     preserve_ratio, size, transform)
 from .image import image, invert_image
 from .parser import Tree
-from .path import draw_markers, path
+from .path import CACHEABLE_PATH_DATA, draw_markers, path, path_data
 from .shapes import circle, ellipse, line, polygon, polyline, rect
 from .svg import svg
 from .text import text
@@ -47,6 +47,16 @@ TEXT_HINT_METRICS = {
     'optimizeLegibility': cairo.HINT_METRICS_ON,
 }
 
+LINE_CAPS = {
+    'round': cairo.LINE_CAP_ROUND,
+    'square': cairo.LINE_CAP_SQUARE,
+}
+
+LINE_JOINS = {
+    'bevel': cairo.LINE_JOIN_BEVEL,
+    'round': cairo.LINE_JOIN_ROUND,
+}
+
 TAGS = {
     'a': text,
     'circle': circle,
@@ -74,11 +84,91 @@ TAGS = {
 PATH_TAGS = frozenset((
     'circle', 'ellipse', 'line', 'path', 'polygon', 'polyline', 'rect'))
 
+TEXT_TAGS = frozenset(('a', 'text', 'textPath', 'tspan'))
+
 INVISIBLE_TAGS = frozenset((
     'clipPath', 'filter', 'linearGradient', 'marker', 'mask', 'pattern',
     'radialGradient', 'symbol'))
 
 
+class RenderPlan:
+    """Drawing properties of a node, parsed once and shared by surfaces.
+
+    Only values that don't depend on the surface are stored, lengths are
+    kept as strings as they depend on the size and the resolution of the
+    surface. Plans can be used to draw the same node with different scales
+    and output formats.
+
+    """
+    __slots__ = (
+        'antialias', 'clip_path', 'clip_rect', 'dash_array', 'dash_offset',
+        'display', 'even_odd', 'fill', 'fill_opacity', 'filter', 'line_cap',
+        'line_join', 'mask', 'miter_limit', 'opacity', 'stroke',
+        'stroke_opacity', 'text_rendering', 'visible')
+
+    def __init__(self, node):
+        self.mask = parse_url(node.get('mask')).fragment
+        self.filter = parse_url(node.get('filter')).fragment
+        self.clip_path = parse_url(node.get('clip-path')).fragment
+        self.clip_rect = tuple(clip_rect(node.get('clip')))
+        self.opacity = float(node.get('opacity', 1))
+        self.fill_opacity = float(node.get('fill-opacity', 1))
+        self.stroke_opacity = float(node.get('stroke-opacity', 1))
+        self.fill = paint(node.get('fill', 'black'))
+        self.stroke = paint(node.get('stroke'))
+        self.even_odd = node.get('fill-rule') == 'evenodd'
+        self.line_cap = LINE_CAPS.get(node.get('stroke-linecap'))
+        self.line_join = LINE_JOINS.get(node.get('stroke-linejoin'))
+        self.dash_array = tuple(
+            normalize(node.get('stroke-dasharray', '')).split())
+        self.dash_offset = node.get('stroke-dashoffset')
+        self.miter_limit = float(node.get('stroke-miterlimit', 4))
+        self.antialias = SHAPE_ANTIALIAS.get(
+            node.get('shape-rendering'), cairo.ANTIALIAS_DEFAULT)
+        self.text_rendering = node.get('text-rendering')
+        self.display = node.get('display', 'inline') != 'none'
+        self.visible = self.display and (
+            node.get('visibility', 'visible') != 'hidden')
+
+
+def render_plan(node):
+    """Get the :class:`RenderPlan` of ``node``.
+
+    The plan is built when first needed and stored in the node, until the
+    node is modified.
+
+    """
+    plan = getattr(node, 'plan', None)
+    if plan is None:
+        if 'font' in node:
+            font = parse_font(node['font'])
+            for att in font:
+                if att not in node:
+                    node[att] = font[att]
+        plan = node.plan = RenderPlan(node)
+    return plan
+
+
+def prepare_tree(tree):
+    """Build the render plans and the unitless path data of ``tree``.
+
+    Clones of the tree share them with the tree, they are not built again
+    each time a clone is drawn. Children not built yet by lazy nodes are
+    ignored.
+
+    """
+    nodes = [tree]
+    while nodes:
+        node = nodes.pop()
+        render_plan(node)
+        if node.tag == 'path' and CACHEABLE_PATH_DATA.fullmatch(
+                node.get('d', '')):
+            # Path data without units is parsed without a surface
+            path_data(None, node)
+        if node._children:
+            nodes.extend(node._children)
+
+
 class Surface(object):
     """Abstract base class for CairoSVG surfaces.
 
@@ -98,7 +188,9 @@ class Surface(object):
                 parent_width=None, parent_height=None, scale=1, unsafe=False,
                 background_color=None, negate_colors=False,
                 invert_images=False, write_to=None, output_width=None,
-                output_height=None, **kwargs):
+                output_height=None, document_cache=None,
+                simplify_tolerance=None, tolerance=None, spatial_index=False,
+                **kwargs):
         """Convert an SVG document to the format for this class.
 
         Specify the input by passing one of these:
@@ -119,7 +211,20 @@ class Surface(object):
                        This does NOT restrict fetching of the main SVG input
                        specified via the ``url`` parameter.
                        Applications should validate input URLs to prevent SSRF.
-
+        :param document_cache: A :class:`cairosvg.parser.DocumentCache`
+                               instance keeping parsed documents for the next
+                               conversions.
+        :param simplify_tolerance: The distance in device units allowed
+                                   between shapes and their simplified
+                                   versions, giving faster drawings with
+                                   fewer details.
+        :param tolerance: The maximum distance in device units between curves
+                          and the lines drawing them, lower values giving
+                          smoother curves but slower drawings.
+        :param spatial_index: A boolean building a
+                              :class:`cairosvg.bounding_box.SpatialIndex` of
+                              the elements, used to skip the elements outside
+                              of the output.
 
         Specifiy the output with:
 
@@ -130,15 +235,92 @@ class Surface(object):
         parameters are keyword-only.
 
         """
-        tree = Tree(
-            bytestring=bytestring, file_obj=file_obj, url=url, unsafe=unsafe,
-            **kwargs)
+        # The tree is only used for this conversion, XML elements can be
+        # released once the nodes are created
+        kwargs.setdefault('release_elements', True)
+        if document_cache is None:
+            tree = Tree(
+                bytestring=bytestring, file_obj=file_obj, url=url,
+                unsafe=unsafe, **kwargs)
+        else:
+            # Render plans and path data of cached trees are shared by clones
+            tree = document_cache.get_tree(
+                bytestring=bytestring, file_obj=file_obj, url=url,
+                unsafe=unsafe, prepare=prepare_tree, **kwargs)
+        return cls.convert_tree(
+            tree, dpi=dpi, parent_width=parent_width,
+            parent_height=parent_height, scale=scale,
+            background_color=background_color, negate_colors=negate_colors,
+            invert_images=invert_images, write_to=write_to,
+            output_width=output_width, output_height=output_height,
+            simplify_tolerance=simplify_tolerance, tolerance=tolerance,
+            spatial_index=spatial_index)
+
+    @classmethod
+    def convert_tree(cls, tree, *, dpi=96, parent_width=None,
+                     parent_height=None, scale=1, background_color=None,
+                     negate_colors=False, invert_images=False, write_to=None,
+                     output_width=None, output_height=None,
+                     simplify_tolerance=None, tolerance=None,
+                     spatial_index=False):
+        """Convert a parsed :class:`cairosvg.parser.Tree`.
+
+        Parameters are the same as the ones of :meth:`convert`, except the
+        ones used to parse the document. Drawing modifies the nodes of the
+        tree, convert a clone given by :meth:`cairosvg.parser.Node.clone` to
+        keep the tree and convert it again.
+
+        """
         output = write_to or io.BytesIO()
         instance = cls(
             tree, output, dpi, None, parent_width, parent_height, scale,
             output_width, output_height, background_color,
             map_rgba=negate_color if negate_colors else None,
-            map_image=invert_image if invert_images else None)
+            map_image=invert_image if invert_images else None,
+            simplify_tolerance=simplify_tolerance, tolerance=tolerance,
+            spatial_index=spatial_index)
+        instance.finish()
+        if write_to is None:
+            return output.getvalue()
+
+    @classmethod
+    def replay(cls, recording, *, write_to=None, scale=1, output_width=None,
+               output_height=None, background_color=None):
+        """Paint a :class:`RecordingSurface` in the format for this class.
+
+        The recording is painted by cairo, without drawing the SVG nodes
+        again. Its vector content is painted at the output size given by
+        ``scale``, ``output_width`` and ``output_height``.
+
+        Give the output with ``write_to`` as for :meth:`convert`. The other
+        parameters are not available, as they are applied when recording.
+
+        """
+        output = write_to or io.BytesIO()
+        width, height = output_size(
+            recording.width, recording.height, scale, output_width,
+            output_height)
+
+        # Surfaces are created without a tree to draw
+        instance = cls.__new__(cls)
+        instance.output = output
+        instance.dpi = recording.dpi
+        device_units = instance.device_units_per_user_units
+        instance.cairo, instance.width, instance.height = (
+            instance._create_surface(
+                width * device_units, height * device_units))
+        if 0 in (instance.width, instance.height):
+            raise ValueError('The SVG size is undefined')
+
+        instance.context = cairo.Context(instance.cairo)
+        if background_color:
+            instance.context.set_source_rgba(*color(background_color))
+            instance.context.paint()
+        instance.context.scale(
+            width * device_units / recording.width,
+            height * device_units / recording.height)
+        instance.context.set_source_surface(recording.cairo)
+        instance.context.paint()
         instance.finish()
         if write_to is None:
             return output.getvalue()
@@ -146,7 +328,8 @@ class Surface(object):
     def __init__(self, tree, output, dpi, parent_surface=None,
                  parent_width=None, parent_height=None,
                  scale=1, output_width=None, output_height=None,
-                 background_color=None, map_rgba=None, map_image=None):
+                 background_color=None, map_rgba=None, map_image=None,
+                 simplify_tolerance=None, tolerance=None, spatial_index=False):
         """Create the surface from a filename or a file-like object.
 
         The rendered content is written to ``output`` which can be a filename,
@@ -172,6 +355,8 @@ class Surface(object):
             self.paths = parent_surface.paths
             self.filters = parent_surface.filters
             self.images = parent_surface.images
+            simplify_tolerance = parent_surface.simplify_tolerance
+            tolerance = parent_surface.context.get_tolerance()
         else:
             self.markers = {}
             self.gradients = {}
@@ -181,6 +366,7 @@ class Surface(object):
             self.filters = {}
             self.images = {}
         self._old_parent_node = self.parent_node = None
+        self.states = []
         self.output = output
         self.dpi = dpi
         self.font_size = size(self, '12pt')
@@ -189,21 +375,8 @@ class Surface(object):
         if viewbox is None:
             viewbox = (0, 0, width, height)
 
-        if output_width and output_height:
-            width, height = output_width, output_height
-        elif output_width:
-            if width:
-                # Keep the aspect ratio
-                height *= output_width / width
-            width = output_width
-        elif output_height:
-            if height:
-                # Keep the aspect ratio
-                width *= output_height / height
-            height = output_height
-        else:
-            width *= scale
-            height *= scale
+        width, height = output_size(
+            width, height, scale, output_width, output_height)
 
         # Actual surface dimensions: may be rounded on raster surfaces types
         self.cairo, self.width, self.height = self._create_surface(
@@ -214,6 +387,12 @@ class Surface(object):
             raise ValueError('The SVG size is undefined')
 
         self.context = cairo.Context(self.cairo)
+        # Drawing state of the context, set only when values change
+        self.miter_limit = self.context.get_miter_limit()
+        self.antialias = self.context.get_antialias()
+        self.text_rendering = None
+        if tolerance:
+            self.context.set_tolerance(tolerance)
         # We must scale the context as the surface size is using physical units
         self.context.scale(
             self.device_units_per_user_units, self.device_units_per_user_units)
@@ -227,6 +406,24 @@ class Surface(object):
 
         self.map_rgba = map_rgba
         self.map_image = map_image
+        self.simplify_tolerance = simplify_tolerance
+        self.spatial_index = self.visible_nodes = None
+        if spatial_index:
+            # The index is kept in the tree, or in the original tree of clones,
+            # and built again only when sizes depending on the surface may
+            # have changed
+            key = self.dpi, self.context_width, self.context_height
+            original = tree if tree.original is None else tree.original
+            index = getattr(original, 'spatial_index', None)
+            if index is None or index.key != key:
+                index = original.spatial_index = calculate_spatial_index(
+                    self, tree)
+                index.key = key
+            x1, y1, x2, y2 = self.context.clip_extents()
+            self.spatial_index = index
+            self.visible_nodes = {
+                id(node) for node in index.intersection(
+                    (x1, y1, x2 - x1, y2 - y1))}
         self.draw(tree)
 
     @property
@@ -278,6 +475,19 @@ class Surface(object):
         """Read the surface content."""
         self.cairo.finish()
 
+    def save_state(self):
+        """Push the drawing state not stored in the context."""
+        self.states.append((
+            self.miter_limit, self.antialias, self.text_rendering,
+            self.parent_node, self.font_size, self.context_width,
+            self.context_height))
+
+    def restore_state(self):
+        """Pop the drawing state saved by :meth:`save_state`."""
+        (self.miter_limit, self.antialias, self.text_rendering,
+         self.parent_node, self.font_size, self.context_width,
+         self.context_height) = self.states.pop()
+
     def map_color(self, string, opacity=1):
         """Parse a color ``string`` and apply ``map_rgba`` function to it."""
         rgba = color(string, opacity)
@@ -294,23 +504,28 @@ class Surface(object):
         if node.tag == 'defs':
             return
 
+        # Do not draw nodes known by the spatial index to be outside the clip
+        if self.visible_nodes is not None:
+            original = node if node.original is None else node.original
+            if (id(original) not in self.visible_nodes and
+                    original in self.spatial_index):
+                return
+
+        # Do not draw transparent elements, except texts moving the cursor and
+        # clip paths ignoring opacity
+        plan = render_plan(node)
+        if (self.stroke_and_fill and node.tag not in TEXT_TAGS and
+                plan.opacity <= 0):
+            return
+
         # Do not draw elements with width or height of 0
         if (('width' in node and size(self, node['width']) == 0) or
                 ('height' in node and size(self, node['height']) == 0)):
             return
 
         # Save context and related attributes
-        old_parent_node = self.parent_node
-        old_font_size = self.font_size
-        old_context_size = self.context_width, self.context_height
+        self.save_state()
         self.parent_node = node
-
-        if "font" in node:
-            font = parse_font(node["font"])
-            for att in font:
-                if att not in node:
-                    node[att] = font[att]
-
         self.font_size = size(self, node.get('font-size', '12pt'))
         self.context.save()
 
@@ -319,10 +534,16 @@ class Surface(object):
             self, node.get('transform'),
             transform_origin=node.get('transform-origin'))
 
+        # Do not draw shapes outside of the clip
+        if node.tag in PATH_TAGS and is_outside_clip(self, node):
+            self.context.restore()
+            self.restore_state()
+            return
+
         # Find and prepare opacity, masks and filters
-        mask = parse_url(node.get('mask')).fragment
-        filter_ = parse_url(node.get('filter')).fragment
-        opacity = float(node.get('opacity', 1))
+        mask = plan.mask
+        filter_ = plan.filter
+        opacity = plan.opacity
 
         if filter_:
             prepare_filter(self, node, filter_)
@@ -336,30 +557,23 @@ class Surface(object):
             size(self, node.get('y'), 'y'))
 
         # Set node's drawing informations if the ``node.tag`` method exists
-        line_cap = node.get('stroke-linecap')
-        if line_cap == 'square':
-            self.context.set_line_cap(cairo.LINE_CAP_SQUARE)
-        if line_cap == 'round':
-            self.context.set_line_cap(cairo.LINE_CAP_ROUND)
-
-        join_cap = node.get('stroke-linejoin')
-        if join_cap == 'round':
-            self.context.set_line_join(cairo.LINE_JOIN_ROUND)
-        if join_cap == 'bevel':
-            self.context.set_line_join(cairo.LINE_JOIN_BEVEL)
-
-        dash_array = normalize(node.get('stroke-dasharray', '')).split()
-        if dash_array:
-            dashes = [size(self, dash) for dash in dash_array]
+        if plan.line_cap is not None:
+            self.context.set_line_cap(plan.line_cap)
+        if plan.line_join is not None:
+            self.context.set_line_join(plan.line_join)
+
+        if plan.dash_array:
+            dashes = [size(self, dash) for dash in plan.dash_array]
             if sum(dashes):
-                offset = size(self, node.get('stroke-dashoffset'))
+                offset = size(self, plan.dash_offset)
                 self.context.set_dash(dashes, offset)
 
-        miter_limit = float(node.get('stroke-miterlimit', 4))
-        self.context.set_miter_limit(miter_limit)
+        if plan.miter_limit != self.miter_limit:
+            self.context.set_miter_limit(plan.miter_limit)
+            self.miter_limit = plan.miter_limit
 
         # Clip
-        rect_values = clip_rect(node.get('clip'))
+        rect_values = plan.clip_rect
         if len(rect_values) == 4:
             top = size(self, rect_values[0], 'y')
             right = size(self, rect_values[1], 'x')
@@ -375,9 +589,8 @@ class Surface(object):
                 left, top, width - left - right, height - top - bottom)
             self.context.restore()
             self.context.clip()
-        clip_path = parse_url(node.get('clip-path')).fragment
-        if clip_path:
-            path = self.paths.get(clip_path)
+        if plan.clip_path:
+            path = self.paths.get(plan.clip_path)
             if path:
                 self.context.save()
                 if path.get('clipPathUnits') == 'objectBoundingBox':
@@ -399,9 +612,11 @@ class Surface(object):
                 self.context.clip()
                 self.context.set_fill_rule(cairo.FILL_RULE_WINDING)
 
-        save_cursor = copy.deepcopy(
-            (self.cursor_position, self.cursor_d_position,
-             self.text_path_width))
+        # Save the text cursor, moved when text is drawn as a path
+        if node.tag in TEXT_TAGS:
+            save_cursor = (
+                self.cursor_position, list(self.cursor_d_position),
+                self.text_path_width)
 
         # Only draw known tags
         if node.tag in TAGS:
@@ -412,59 +627,80 @@ class Surface(object):
                 pass
 
         # Get stroke and fill opacity
-        stroke_opacity = float(node.get('stroke-opacity', 1))
-        fill_opacity = float(node.get('fill-opacity', 1))
+        stroke_opacity = plan.stroke_opacity
+        fill_opacity = plan.fill_opacity
         if opacity < 1 and not node.children:
             stroke_opacity *= opacity
             fill_opacity *= opacity
 
         # Manage display and visibility
-        display = node.get('display', 'inline') != 'none'
-        visible = display and (node.get('visibility', 'visible') != 'hidden')
+        display = plan.display
+        visible = plan.visible
 
         # Set font rendering properties
-        self.context.set_antialias(SHAPE_ANTIALIAS.get(
-            node.get('shape-rendering'), cairo.ANTIALIAS_DEFAULT))
-
-        font_options = self.context.get_font_options()
-        font_options.set_antialias(TEXT_ANTIALIAS.get(
-            node.get('text-rendering'), cairo.ANTIALIAS_DEFAULT))
-        font_options.set_hint_style(TEXT_HINT_STYLE.get(
-            node.get('text-rendering'), cairo.HINT_STYLE_DEFAULT))
-        font_options.set_hint_metrics(TEXT_HINT_METRICS.get(
-            node.get('text-rendering'), cairo.HINT_METRICS_DEFAULT))
-        self.context.set_font_options(font_options)
+        if plan.antialias != self.antialias:
+            self.context.set_antialias(plan.antialias)
+            self.antialias = plan.antialias
+
+        text_rendering = plan.text_rendering
+        if text_rendering != self.text_rendering:
+            font_options = self.context.get_font_options()
+            font_options.set_antialias(TEXT_ANTIALIAS.get(
+                text_rendering, cairo.ANTIALIAS_DEFAULT))
+            font_options.set_hint_style(TEXT_HINT_STYLE.get(
+                text_rendering, cairo.HINT_STYLE_DEFAULT))
+            font_options.set_hint_metrics(TEXT_HINT_METRICS.get(
+                text_rendering, cairo.HINT_METRICS_DEFAULT))
+            self.context.set_font_options(font_options)
+            self.text_rendering = text_rendering
 
         # Fill and stroke
         if self.stroke_and_fill and visible and node.tag in TAGS:
             # Fill
-            self.context.save()
-            paint_source, paint_color = paint(node.get('fill', 'black'))
-            if node.get('fill-rule') == 'evenodd':
-                self.context.set_fill_rule(cairo.FILL_RULE_EVEN_ODD)
-            if not gradient_or_pattern(self, node, paint_source, fill_opacity):
-                self.context.set_source_rgba(
-                    *self.map_color(paint_color, fill_opacity))
-            if TAGS[node.tag] == text:
-                self.cursor_position = save_cursor[0]
-                self.cursor_d_position = save_cursor[1]
-                self.text_path_width = save_cursor[2]
-                text(self, node, draw_as_text=True)
-            else:
+            paint_source, paint_color = plan.fill
+            rgba = None if paint_source else self.map_color(
+                paint_color, fill_opacity)
+            if node.tag in TEXT_TAGS or paint_source or plan.even_odd:
+                self.context.save()
+                if plan.even_odd:
+                    self.context.set_fill_rule(cairo.FILL_RULE_EVEN_ODD)
+                if not gradient_or_pattern(
+                        self, node, paint_source, fill_opacity):
+                    self.context.set_source_rgba(
+                        *self.map_color(paint_color, fill_opacity))
+                if node.tag in TEXT_TAGS:
+                    self.cursor_position = save_cursor[0]
+                    self.cursor_d_position = save_cursor[1]
+                    self.text_path_width = save_cursor[2]
+                    text(self, node, draw_as_text=True)
+                elif fill_opacity > 0:
+                    self.context.fill_preserve()
+                self.context.restore()
+            elif rgba[3] > 0:
+                # Plain colors are kept until the end of the node drawing
+                self.context.set_source_rgba(*rgba)
                 self.context.fill_preserve()
-            self.context.restore()
 
             # Stroke
-            self.context.save()
-            self.context.set_line_width(
-                size(self, node.get('stroke-width', '1')))
-            paint_source, paint_color = paint(node.get('stroke'))
-            if not gradient_or_pattern(
-                    self, node, paint_source, stroke_opacity):
-                self.context.set_source_rgba(
-                    *self.map_color(paint_color, stroke_opacity))
-            self.context.stroke()
-            self.context.restore()
+            paint_source, paint_color = plan.stroke
+            line_width = size(self, node.get('stroke-width', '1'))
+            if paint_source and stroke_opacity > 0 and line_width > 0:
+                self.context.save()
+                self.context.set_line_width(line_width)
+                if not gradient_or_pattern(
+                        self, node, paint_source, stroke_opacity):
+                    self.context.set_source_rgba(
+                        *self.map_color(paint_color, stroke_opacity))
+                self.context.stroke()
+                self.context.restore()
+            else:
+                rgba = self.map_color(paint_color, stroke_opacity)
+                if rgba[3] > 0 and line_width > 0:
+                    self.context.set_line_width(line_width)
+                    self.context.set_source_rgba(*rgba)
+                    self.context.stroke()
+                else:
+                    self.context.new_path()
         elif not visible:
             self.context.new_path()
 
@@ -478,7 +714,10 @@ class Surface(object):
 
         # Apply filter, mask and opacity
         if filter_ or mask or (opacity < 1 and node.children):
+            # The drawing state is restored with the group
             self.context.pop_group_to_source()
+            self.miter_limit, self.antialias, self.text_rendering = (
+                self.states[-1][:3])
             if filter_:
                 apply_filter_before_painting(self, node, filter_)
             if mask in self.masks:
@@ -495,9 +734,7 @@ class Surface(object):
             self.text_path_width = 0
 
         self.context.restore()
-        self.parent_node = old_parent_node
-        self.font_size = old_font_size
-        self.context_width, self.context_height = old_context_size
+        self.restore_state()
 
 
 class PDFSurface(Surface):
@@ -538,6 +775,23 @@ class PNGSurface(Surface):
         return super().finish()
 
 
+class RecordingSurface(Surface):
+    """A surface recording the drawing operations in memory.
+
+    The recording can be painted by :meth:`Surface.replay` in other formats
+    and at other sizes, without drawing the SVG nodes again. The surface
+    must not be finished before being replayed.
+
+    """
+    device_units_per_user_units = 1
+
+    def _create_surface(self, width, height):
+        """Create and return ``(cairo_surface, width, height)``."""
+        cairo_surface = cairo.RecordingSurface(
+            cairo.CONTENT_COLOR_ALPHA, (0, 0, width, height))
+        return cairo_surface, width, height
+
+
 class SVGSurface(Surface):
     """A surface that writes in SVG format.
 
@@ -7,11 +7,14 @@ These tests can be used as deployment tests.
 
 import io
 import sys
+from math import isnan, pi
 
 import cairocffi as cairo
 import pytest
 
-from . import SURFACES, VERSION, parser, surface, svg2pdf, svg2png
+from . import (
+    SURFACES, VERSION, bounding_box, colors, compile_document, convert_many,
+    css, defs, helpers, parser, path, surface, svg2pdf, svg2png)
 from .__main__ import main
 
 MAGIC_NUMBERS = {
@@ -188,3 +191,635 @@ def test_script(tmp_path):
     # Explicit -f wins
     assert not test_main([svg_filename, '-o', str(temp_3), '-f', 'pdf'])
     assert read_file(str(temp_3))[:100] == expected_pdf
+
+
+def test_node_inheritance():
+    """Check that inherited properties are shared but behave like copies."""
+    tree = parser.Tree(bytestring=b'''
+      <svg xmlns="http://www.w3.org/2000/svg" fill="red" x="3">
+        <g stroke="blue"><rect y="1"/></g>
+      </svg>''')
+    group = tree.children[0]
+    rect = group.children[0]
+    assert dict(rect) == {'fill': 'red', 'stroke': 'blue', 'y': '1'}
+    assert rect['fill'] == 'red' and 'x' not in rect
+
+    # Modifying the parent doesn't change the values inherited by children
+    group['stroke'] = 'green'
+    assert rect['stroke'] == 'blue'
+
+    # Inherited values can be deleted
+    del rect['fill']
+    assert 'fill' not in rect and tree['fill'] == 'red'
+
+
+def test_release_elements():
+    """Check that trees without XML elements are rendered the same way."""
+    tree = parser.Tree(bytestring=SVG_SAMPLE, release_elements=True)
+    assert tree.xml_tree is not None
+    assert tree.children[0].element is None
+    png_surface = surface.PNGSurface(tree, io.BytesIO(), 96)
+    assert png_surface.cairo.get_data()[:] == (
+        surface.PNGSurface(parser.Tree(bytestring=SVG_SAMPLE), None, 96)
+        .cairo.get_data()[:])
+
+
+def test_lazy_tree():
+    """Check that lazy trees only create the nodes that are drawn."""
+    svg = b'''
+      <svg xmlns="http://www.w3.org/2000/svg" width="10" height="10">
+        <defs><symbol id="unused"><rect width="5" height="5"/></symbol></defs>
+        <g display="none"><rect width="5" height="5"/></g>
+        <rect width="5" height="5" fill="red"/>
+      </svg>'''
+    tree = parser.Tree(bytestring=svg, lazy=True)
+    defs, hidden, _ = tree.children
+    assert defs._children is None and hidden._children is None
+    png_surface = surface.PNGSurface(tree, None, 96)
+    assert defs._children is None and hidden._children is None
+    assert png_surface.cairo.get_data()[:] == (
+        surface.PNGSurface(parser.Tree(bytestring=svg), None, 96)
+        .cairo.get_data()[:])
+
+
+def test_definition_parents():
+    """Check that lazy nodes including definitions are found at once."""
+    tree = parser.Tree(bytestring=b'''
+      <svg xmlns="http://www.w3.org/2000/svg" width="10" height="10">
+        <g><g><linearGradient id="gradient"/></g></g>
+        <g><g><rect width="5" height="5" fill="url(#gradient)"/></g></g>
+      </svg>''', lazy=True)
+    parents = defs.definition_parents(tree.element.etree_element)
+    assert defs.definition_parents(tree.element.etree_element) is parents
+    with_defs, without_defs = tree.children
+    assert defs.has_defs(tree, parents)
+    assert defs.has_defs(with_defs, parents)
+    assert defs.has_defs(with_defs.children[0], parents)
+    assert not defs.has_defs(with_defs.children[0].children[0], parents)
+    assert not defs.has_defs(without_defs, parents)
+    png_surface = surface.PNGSurface(tree, None, 96)
+    assert 'gradient' in png_surface.gradients
+    assert without_defs.children[0]._children is not None
+
+
+def test_element_ids():
+    """Check that the elements found by id are the first ones."""
+    tree = parser.Tree(bytestring=b'''
+      <svg xmlns="http://www.w3.org/2000/svg">
+        <rect id="a" width="1"/><rect id="b"/><rect id="a" width="2"/>
+        <use href="#a"/>
+      </svg>''')
+    use = tree.children[-1]
+    assert parser.Tree(url='#a', parent=use)['width'] == '1'
+    assert parser.Tree(url='#b', parent=use).tag == 'rect'
+    assert tree.ids.get('c') is None
+    with pytest.raises(TypeError):
+        parser.Tree(url='#c', parent=use)
+
+
+def test_document_cache():
+    """Check that cached documents are reused and can be drawn many times."""
+    svg = b'''
+      <svg xmlns="http://www.w3.org/2000/svg" width="4" height="4">
+        <rect id="a" width="2" height="2"/><use href="#a" x="2" y="2"/>
+      </svg>'''
+    document_cache = parser.DocumentCache()
+    png = svg2png(svg)
+    assert svg2png(svg, document_cache=document_cache) == png
+    assert svg2png(svg, document_cache=document_cache) == png
+    assert svg2pdf(svg, document_cache=document_cache)
+    assert (document_cache.hits, document_cache.misses) == (2, 1)
+    assert svg2png(svg, document_cache=document_cache, dpi=72) == png
+    assert (document_cache.hits, document_cache.misses) == (3, 1)
+    assert svg2png(svg + b' ', document_cache=document_cache) == png
+    assert (document_cache.hits, document_cache.misses) == (3, 2)
+    assert len(document_cache) == 2
+    prepared = []
+    for _ in range(2):
+        document_cache.get_tree(bytestring=svg, prepare=prepared.append)
+    assert len(prepared) == 1
+
+    document_cache = parser.DocumentCache(max_nodes=3)
+    svg2png(svg, document_cache=document_cache)
+    svg2png(svg.replace(b'"2"', b'"1"'), document_cache=document_cache)
+    svg2png(svg, document_cache=document_cache)
+    assert len(document_cache) == 1
+    assert document_cache.nodes == 3
+    assert document_cache.misses == 3
+
+    fetched = []
+
+    def url_fetcher(url, resource_type):
+        fetched.append(url)
+        return svg
+
+    tree = document_cache.get_tree(
+        url='https://example.com/image.svg#a', url_fetcher=url_fetcher)
+    assert fetched == ['https://example.com/image.svg']
+    assert tree['id'] == 'a' and tree.url == 'https://example.com/image.svg'
+
+
+def test_compiled_document(tmp_path):
+    """Check that compiled documents are drawn like SVG documents."""
+    svg = b'''
+      <svg xmlns="http://www.w3.org/2000/svg" width="4" height="4">
+        <style>rect { fill: red }</style>
+        <rect style="fill: blue" width="2" height="4"/>
+        <rect x="2" width="2" height="4"/>
+      </svg>'''
+    compiled = compile_document(bytestring=svg)
+    assert compiled.startswith(parser.COMPILED_HEADER)
+    assert svg2png(compiled) == svg2png(svg)
+
+    svg_path = tmp_path / 'test.svg'
+    svg_path.write_bytes(svg)
+    compiled_path = tmp_path / 'test.svgc'
+    png_path = tmp_path / 'test.png'
+    main([str(svg_path), '--compile', '-o', str(compiled_path)])
+    assert compiled_path.read_bytes() == compiled
+    main([str(compiled_path), '-o', str(png_path)])
+    assert png_path.read_bytes() == svg2png(svg)
+
+    with pytest.raises(ValueError):
+        svg2png(compiled.replace(VERSION.encode(), b'0.1', 1))
+
+
+def test_compiled_path_data(monkeypatch):
+    """Check that compiled documents include path data and ids."""
+    svg = b'''
+      <svg xmlns="http://www.w3.org/2000/svg"
+           xmlns:xlink="http://www.w3.org/1999/xlink" width="4" height="4">
+        <defs><path id="left" d="M0 0H2V4z"/></defs>
+        <use xlink:href="#left"/>
+        <path id="right" d="M2 0H4V4z" fill="red"/>
+      </svg>'''
+    png = svg2png(svg)
+    compiled = compile_document(bytestring=svg)
+
+    def parse_path(surface, string):
+        raise AssertionError('Path data parsed')
+
+    monkeypatch.setattr(path, 'parse_path', parse_path)
+    tree = parser.Tree(bytestring=compiled)
+    assert tree.ids.ids.keys() == {'left', 'right'}
+    assert tree.children[2].path_data.commands == (
+        (path.PATH_MOVE_TO, (2, 0)), (path.PATH_LINE_TO, (4, 0)),
+        (path.PATH_LINE_TO, (4, 4)), (path.PATH_CLOSE_PATH, ()))
+    assert svg2png(compiled) == png
+
+
+def test_no_stylesheet():
+    """Check that elements are only matched when CSS rules are defined."""
+    tree = parser.Tree(bytestring=b'''
+      <svg xmlns="http://www.w3.org/2000/svg">
+        <rect style="fill: red" class="a"/><svg:circle xmlns:svg="svg"/>
+      </svg>''')
+    assert tree.style is None
+    assert tree.children[0]['fill'] == 'red'
+    assert tree.children[1].tag == '{svg}circle'
+
+    tree = parser.Tree(bytestring=b'''
+      <svg xmlns="http://www.w3.org/2000/svg">
+        <style>.a { fill: blue }</style><rect style="stroke: red" class="a"/>
+      </svg>''')
+    assert tree.style is not None
+    assert tree.children[1]['fill'] == 'blue'
+    assert tree.children[1]['stroke'] == 'red'
+
+
+def test_style_matcher():
+    """Check that matching results are only shared by similar elements."""
+    tree = parser.Tree(bytestring=b'''
+      <svg xmlns="http://www.w3.org/2000/svg">
+        <style>g.a rect { fill: red } rect[width="2"] { stroke: blue }</style>
+        <g class="a"><rect/><rect width="2"/></g><g><rect/><rect/></g>
+      </svg>''')
+    first_group, second_group = tree.children[1:]
+    assert [rect.get('fill') for rect in first_group.children] == ['red'] * 2
+    assert [rect.get('stroke') for rect in first_group.children] == [
+        None, 'blue']
+    assert [rect.get('fill') for rect in second_group.children] == [None] * 2
+    assert len(tree.style.matches) == 7
+
+    tree = parser.Tree(bytestring=b'''
+      <svg xmlns="http://www.w3.org/2000/svg">
+        <style>rect + rect { fill: red }</style><rect/><rect/>
+      </svg>''')
+    assert tree.style.matches is None
+    assert [rect.get('fill') for rect in tree.children[1:]] == [None, 'red']
+
+
+def test_style_attribute_cache():
+    """Check that identical style attributes are parsed once."""
+    css.parse_style_attribute.cache_clear()
+    tree = parser.Tree(bytestring=b'''
+      <svg xmlns="http://www.w3.org/2000/svg">
+        <rect style="fill: red; stroke: blue !important"/>
+        <rect style="fill: red; stroke: blue !important"/>
+      </svg>''')
+    assert [rect['fill'] for rect in tree.children] == ['red', 'red']
+    assert [rect['stroke'] for rect in tree.children] == ['blue', 'blue']
+    cache_info = css.parse_style_attribute.cache_info()
+    assert (cache_info.hits, cache_info.misses) == (1, 1)
+
+
+def test_value_parsing_cache():
+    """Check that parsed values are cached and resolved with the surface."""
+    assert helpers.parse_size('2.5') == (2.5, None)
+    assert helpers.parse_size('50%') == (50, '%')
+    assert helpers.parse_size('1in') == (1, 'in')
+    assert helpers.parse_size('2vw') == (0, '')
+    assert helpers.parse_viewbox('0,0 10\n20') == (0, 0, 10, 20)
+    assert helpers.parse_transform('translate(1, 2) scale(3)') == (
+        ('translate', ('1', '2')), ('scale', ('3',)))
+    assert helpers.transform_coefficients('translate(1) scale(2)') == (
+        2, 0, 0, 2, 1, 0)
+    assert helpers.transform_coefficients('translate(1mm)') is None
+
+    helpers.parse_size.cache_clear()
+    tree = parser.Tree(bytestring=b'''
+      <svg xmlns="http://www.w3.org/2000/svg" width="1in" height="1in">
+        <rect width="1in" height="50%" fill="#123"/>
+      </svg>''')
+    png_surface = surface.PNGSurface(tree, None, 96)
+    rect = tree.children[0]
+    assert helpers.size(png_surface, rect['width'], 'x') == 96
+    assert helpers.size(png_surface, rect['height'], 'y') == 48
+    assert helpers.parse_size.cache_info().hits
+    assert colors.color('#123', .5) == colors.color('#112233', .5)
+
+
+def test_path_commands():
+    """Check that path data are split into commands with their values."""
+    assert list(helpers.path_commands(None, 'M1,2 3-4e1m.5.5 1 1')) == [
+        ('M', (1, 2)), ('L', (3, -40)), ('m', (.5, .5)), ('l', (1, 1))]
+    assert list(helpers.path_commands(None, 'a1 2 30 1150 60Zh')) == [
+        ('a', (1, 2, 30, 1, 1, 50, 60)), ('Z', ()), ('h', (0,))]
+    assert list(helpers.path_commands(None, 'z 1 1')) == [('z', ())]
+    assert list(helpers.path_commands(None, 'M1.5.5-2E1+3')) == [
+        ('M', (1.5, .5)), ('L', (-20, 3))]
+    with pytest.raises(helpers.PointError):
+        list(helpers.path_commands(None, 'M 1 2 L 3'))
+
+
+def test_path_data():
+    """Check that path data are parsed into absolute commands."""
+    data = path.parse_path(None, 'm1 2 h3 v4 z l1 1 a2 2 0 0 1 4 0')
+    assert data.commands[:5] == (
+        (path.PATH_MOVE_TO, (1, 2)), (path.PATH_LINE_TO, (4, 2)),
+        (path.PATH_LINE_TO, (4, 6)), (path.PATH_CLOSE_PATH, ()),
+        (path.PATH_LINE_TO, (2, 3)))
+    assert data.commands[5][0] == path.PATH_ARC
+    assert data.arcs
+    assert list(data.vertices[:4]) == [1, 2, pi, 0]
+    node = parser.Tree(bytestring=b'''
+      <svg xmlns="http://www.w3.org/2000/svg">
+        <path d="m1 2 h3 v4 z l1 1 a2 2 0 0 1 4 0"/>
+      </svg>''').children[0]
+    assert bounding_box.calculate_bounding_box(None, node) == (1, 1, 5, 5)
+
+    # Path data is parsed again when the node is changed
+    tree = parser.Tree(bytestring=b'''
+      <svg xmlns="http://www.w3.org/2000/svg" width="10" height="10">
+        <path d="M1 2H4"/>
+      </svg>''')
+    surface.PNGSurface(tree, None, 96)
+    node = tree.children[0]
+    assert list(node.vertices[:2]) == [1, 2]
+    node['d'] = 'M3 4H5'
+    assert node.vertices is None
+    assert bounding_box.bounding_box_path(None, node) == (3, 4, 2, 0)
+    assert node.clone().path_data is node.path_data
+    data = node.path_data
+    bounding_box.calculate_bounding_box(None, node)
+    assert node.path_data is data
+
+
+def test_path_cache():
+    """Check that parsed path data is shared between documents."""
+    svg = b'''
+      <svg xmlns="http://www.w3.org/2000/svg" width="4" height="4">
+        <path d="M0 0H4V4z"/><path d="M0 0H4V4z"/><path d="M0 0H4in"/>
+      </svg>'''
+    png = svg2png(svg)
+    path.PATH_CACHE = path.PathCache()
+    try:
+        assert svg2png(svg) == png
+        assert svg2png(svg) == png
+    finally:
+        path_cache, path.PATH_CACHE = path.PATH_CACHE, None
+    assert (path_cache.hits, path_cache.misses) == (3, 3)
+    assert path_cache.hit_rate == .5
+    assert len(path_cache) == 1
+    assert path_cache.size > len('M0 0H4V4z')
+
+    path_cache = path.PathCache(max_size=path_cache.size - 1)
+    path_cache.get_path_data(None, 'M0 0H4V4z')
+    assert len(path_cache) == path_cache.size == 0
+
+
+def test_marker_vertices():
+    """Check that markers are drawn on the vertices of shapes."""
+    svg = b'''
+      <svg xmlns="http://www.w3.org/2000/svg" width="8" height="8">
+        <marker id="m" markerWidth="2" markerHeight="2">
+          <rect width="2" height="2"/>
+        </marker>
+        <g %s>
+          <polyline points="0 0 4 0 4 4"/>
+          <line y1="8" x2="8" y2="8"/>
+          <path d="M0 0 4 0M4 0 4 4"/>
+        </g>
+      </svg>'''
+    tree = parser.Tree(bytestring=svg % b'marker="url(#m)"')
+    surface.PNGSurface(tree, None, 96)
+    polyline, line, path = tree.children[1].children
+    assert list(polyline.vertices) == [
+        0, 0, pi, 0, 4, 0, pi / 2, pi / 2, 4, 4]
+    assert list(line.vertices) == [0, 8, pi, 0, 8, 8]
+    assert list(path.vertices[:6]) == [0, 0, pi, 0, 4, 0]
+    assert isnan(path.vertices[6]) and isnan(path.vertices[7])
+    assert svg2png(svg % b'marker="url(#m)"') != svg2png(svg % b'')
+
+
+def test_marker_recording():
+    """Check that markers are drawn like the same shapes on vertices."""
+    marker = b'''
+      <svg xmlns="http://www.w3.org/2000/svg" width="8" height="8">
+        <marker id="m" markerUnits="userSpaceOnUse" refX="1" refY="1"
+                markerWidth="2" markerHeight="2">
+          <rect width="2" height="2" fill="red"/>
+        </marker>
+        <polyline points="1 1 5 1 5 5" fill="none" marker="url(#m)"/>
+      </svg>'''
+    rects = b'''
+      <svg xmlns="http://www.w3.org/2000/svg" width="8" height="8">
+        <polyline points="1 1 5 1 5 5" fill="none"/>
+        <rect width="2" height="2" fill="red"/>
+        <rect x="4" width="2" height="2" fill="red"/>
+        <rect x="4" y="4" width="2" height="2" fill="red"/>
+      </svg>'''
+    assert svg2png(marker) == svg2png(rects)
+
+
+def test_parse_points():
+    """Check that points are parsed at once, with or without units."""
+    assert list(helpers.parse_points(None, '1,2 3-4e1 .5.5')) == [
+        1, 2, 3, -40, .5, .5]
+    assert list(helpers.parse_points(None, '1 2px')) == [1, 0]
+    assert not helpers.parse_points(None, ' ')
+    svg = b'''
+      <svg xmlns="http://www.w3.org/2000/svg" width="4" height="4">
+        <polyline points="0 0 4 0 4 4 %s"/>
+      </svg>'''
+    assert svg2png(svg % b'0') == svg2png(svg % b'')
+
+
+def test_simplify_points():
+    """Check that simplified polylines stay within the tolerance."""
+    points = [(x, (x % 2) / 10) for x in range(100)] + [(50, 50)]
+    simplified = helpers.simplify_points(points, 1)
+    assert simplified == [(0, 0), (99, .1), (50, 50)]
+    assert helpers.simplify_points(points, .05) == points
+    svg = b'''
+      <svg xmlns="http://www.w3.org/2000/svg" width="4" height="4">
+        <polyline points="0 0 2 .01 4 0 4 4"/>
+      </svg>'''
+    assert svg2png(svg, simplify_tolerance=1) == svg2png(
+        svg.replace(b'2 .01 ', b''))
+
+
+def test_tolerance():
+    """Check that arcs are drawn according to the tolerance."""
+    tree = parser.Tree(bytestring=b'''
+      <svg xmlns="http://www.w3.org/2000/svg" width="100" height="100">
+        <path d="M0 50 A50 50 0 0 0 100 50"/>
+      </svg>''')
+    data = path.path_data(None, tree.children[0])
+    curves = []
+    for tolerance in (None, .1, .001):
+        png_surface = surface.PNGSurface(tree, None, 96, tolerance=tolerance)
+        assert png_surface.context.get_tolerance() == (tolerance or .1)
+        png_surface.context.new_path()
+        path.append_path_data(png_surface, data)
+        assert png_surface.context.get_tolerance() == (tolerance or .1)
+        curves.append(sum(
+            operation == path.PATH_CURVE_TO
+            for operation, _ in png_surface.context.copy_path()))
+    assert curves[0] == curves[1] < curves[2]
+
+
+def test_clip_culling():
+    """Check that shapes outside of the clip are detected."""
+    tree = parser.Tree(bytestring=b'''
+      <svg xmlns="http://www.w3.org/2000/svg" width="10" height="10">
+        <rect x="20" y="0" width="5" height="5"/>
+        <rect x="20" y="0" width="5" height="5" stroke="red" stroke-width="5"/>
+        <rect x="20" y="0" width="5" height="5" filter="url(#filter)"/>
+        <rect x="5" y="5" width="50" height="50"/>
+        <path d="M20 0H30" marker-end="url(#marker)"/>
+        <marker id="marker"><rect width="1" height="1"/></marker>
+      </svg>''')
+    png_surface = surface.PNGSurface(tree, None, 96)
+    assert [
+        bounding_box.is_outside_clip(png_surface, node)
+        for node in tree.children[:5]] == [True, False, False, False, False]
+
+
+def test_shape_bounding_box_cache():
+    """Check that bounding boxes of paths and polylines are kept."""
+    tree = parser.Tree(bytestring=b'''
+      <svg xmlns="http://www.w3.org/2000/svg" width="10" height="10">
+        <path d="M 1 2 L 3 4 5 0"/>
+        <polyline points="1 2 3 4 5"/>
+      </svg>''')
+    png_surface = surface.PNGSurface(tree, None, 96)
+    path_node, polyline_node = tree.children
+    assert path.path_data(png_surface, path_node).bounding_box == (1, 0, 4, 4)
+    assert polyline_node.points_bounding_box == (1, 2, 2, 2)
+    assert polyline_node.clone().points_bounding_box == (1, 2, 2, 2)
+    polyline_node['points'] = '0 0 1 1'
+    assert polyline_node.clone().points_bounding_box is None
+    assert bounding_box.bounding_box_polyline(
+        png_surface, polyline_node) == (0, 0, 1, 1)
+    bounding_box.calculate_bounding_box(png_surface, polyline_node)
+    assert polyline_node.points_bounding_box == (0, 0, 1, 1)
+    assert bounding_box.extend_bounding_box(
+        bounding_box.EMPTY_BOUNDING_BOX,
+        [(x, -x) for x in range(10 ** 6)]) == (0, 1 - 10 ** 6, 999999, 999999)
+
+
+def test_spatial_index():
+    """Check that elements are found in regions of the document."""
+    svg = b'''
+      <svg xmlns="http://www.w3.org/2000/svg" width="10" height="10">
+        <rect id="a" x="1" y="1" width="2" height="2"/>
+        <g id="d">
+          <circle id="e" cx="2" cy="2" r="1" stroke="red" stroke-width="2"/>
+          <text id="f" x="50" y="50">text</text>
+        </g>
+        <g id="b" transform="translate(20 0)">
+          <rect id="c" x="1" y="1" width="2" height="2"/>
+        </g>
+      </svg>'''
+    tree = parser.Tree(bytestring=svg)
+    surface.PNGSurface(tree, None, 96, spatial_index=True)
+    index = tree.spatial_index
+    assert len(index) == 4
+    assert {node['id'] for node in index.at_point(2, 2)} == {'a', 'e'}
+    assert {node['id'] for node in index.at_point(21, 2)} == {'b', 'c'}
+    assert {node['id'] for node in index.at_point(4.5, 2)} == {'e'}
+    assert not index.intersection((10, 10, 5, 5))
+    assert index.at_point(2, 2)[0] in index
+    assert tree.children[1] not in index
+    assert svg2png(svg, spatial_index=True) == svg2png(svg)
+
+    # Indexes are shared by the clones of cached documents
+    document_cache = parser.DocumentCache()
+    png = svg2png(svg, spatial_index=True, document_cache=document_cache)
+    (_, cached_tree), = document_cache.documents.values()
+    index = cached_tree.spatial_index
+    assert index.at_point(2, 2)[0] in cached_tree.children
+    assert svg2png(
+        svg, spatial_index=True, document_cache=document_cache) == png
+    assert cached_tree.spatial_index is index
+    clone = cached_tree.clone().clone()
+    assert clone.original is cached_tree
+    assert clone.children[0].original is cached_tree.children[0]
+
+
+def test_invisible_shapes():
+    """Check that invisible shapes are skipped and drawing state is kept."""
+    svg = '''
+      <svg xmlns="http://www.w3.org/2000/svg" width="10" height="10">
+        <rect width="5" height="5" stroke-miterlimit="10"/>
+        %s
+      </svg>'''
+    invisible = '''
+      <rect width="5" height="5" fill="none"/>
+      <rect width="5" height="5" fill="red" fill-opacity="0" stroke="red"
+            stroke-width="0"/>
+      <g opacity="0"><rect width="5" height="5" fill="red"/></g>'''
+    assert svg2png(svg % invisible) == svg2png(svg % '')
+    tree = parser.Tree(bytestring=(svg % invisible).encode())
+    png_surface = surface.PNGSurface(tree, None, 96)
+    assert png_surface.miter_limit == png_surface.context.get_miter_limit()
+
+
+def test_state_stack():
+    """Check that the drawing state is restored after each node."""
+    tree = parser.Tree(bytestring=b'''
+      <svg xmlns="http://www.w3.org/2000/svg" width="10" height="10">
+        <g font-size="20" opacity="0.5">
+          <svg width="5" height="5"><rect width="5" height="5"/></svg>
+          <text>a<tspan dx="2">b</tspan></text>
+        </g>
+        <rect x="20" width="5" height="5"/>
+      </svg>''')
+    png_surface = surface.PNGSurface(tree, None, 96)
+    assert png_surface.states == []
+    assert png_surface.parent_node is None
+    assert png_surface.font_size == surface.size(png_surface, '12pt')
+    assert (png_surface.context_width, png_surface.context_height) == (10, 10)
+
+
+def test_render_plan():
+    """Check that render plans are shared by surfaces and updated."""
+    tree = parser.Tree(bytestring=b'''
+      <svg xmlns="http://www.w3.org/2000/svg" width="10" height="10">
+        <rect width="5" height="5" style="fill: url(#a) red; opacity: .5"
+              stroke-dasharray="1, 2" stroke-linecap="round"/>
+      </svg>''')
+    surface.PNGSurface(tree, None, 96)
+    rect = tree.children[0]
+    plan = rect.plan
+    assert plan.fill == ('a', 'red')
+    assert plan.opacity == .5
+    assert plan.dash_array == ('1', '2')
+    surface.PDFSurface(tree, None, 72)
+    assert rect.plan is plan
+    assert rect.clone().plan is plan
+    rect['opacity'] = '1'
+    assert surface.render_plan(rect).opacity == 1
+
+    # Plans and path data of cached documents are shared by clones
+    svg = b'''
+      <svg xmlns="http://www.w3.org/2000/svg" width="10" height="10">
+        <path d="M 1 2 L 3 4" fill="red"/>
+      </svg>'''
+    document_cache = parser.DocumentCache()
+    png = svg2png(svg, document_cache=document_cache)
+    (_, cached_tree), = document_cache.documents.values()
+    cached_path = cached_tree.children[0]
+    assert cached_path.plan.fill == (None, 'red')
+    assert cached_path.path_data is not None
+    tree = document_cache.get_tree(
+        bytestring=svg, unsafe=False, release_elements=True)
+    assert document_cache.hits == 1
+    assert tree.children[0].plan is cached_path.plan
+    assert tree.children[0].path_data is cached_path.path_data
+    assert svg2png(svg, document_cache=document_cache) == png
+
+
+def png_pixels(png):
+    """Return the size and the pixels of a PNG image."""
+    image = cairo.ImageSurface.create_from_png(io.BytesIO(png))
+    return image.get_width(), image.get_height(), bytes(image.get_data())
+
+
+def test_recording_replay():
+    """Check that recordings are painted in other formats and sizes."""
+    assert helpers.output_size(10, 20, 2) == (20, 40)
+    assert helpers.output_size(10, 20, output_width=5) == (5, 10)
+    assert helpers.output_size(10, 20, output_height=10) == (5, 10)
+    tree = parser.Tree(bytestring=SVG_SAMPLE)
+    recording = surface.RecordingSurface(tree, None, 96)
+    for format_name in MAGIC_NUMBERS:
+        content = SURFACES[format_name].replay(recording)
+        assert content.startswith(MAGIC_NUMBERS[format_name])
+    replayed = png_pixels(surface.PNGSurface.replay(recording, scale=2))
+    assert replayed[:2] == (768, 960)
+    assert replayed == png_pixels(svg2png(SVG_SAMPLE, scale=2))
+    replayed = png_pixels(
+        surface.PNGSurface.replay(recording, output_width=192))
+    assert replayed[:2] == (192, 240)
+
+
+def test_convert_many(tmp_path):
+    """Check that documents are converted to multiple outputs at once."""
+    path = tmp_path / 'icon.png'
+    results = convert_many(SVG_SAMPLE, outputs=[
+        {'format': 'png', 'output_width': 64}, {'format': 'PNG', 'scale': 2},
+        {'format': 'pdf'}, {'format': 'png', 'write_to': str(path)}])
+    assert results == {
+        0: svg2png(SVG_SAMPLE, output_width=64),
+        1: svg2png(SVG_SAMPLE, scale=2),
+        2: svg2pdf(SVG_SAMPLE),
+        3: None}
+    assert path.read_bytes() == svg2png(SVG_SAMPLE)
+    results = convert_many(SVG_SAMPLE, outputs={'small': {
+        'format': 'png', 'scale': .5}})
+    assert results == {'small': svg2png(SVG_SAMPLE, scale=.5)}
+
+
+def test_convert_many_clones():
+    """Check that drawing an output doesn't modify the following ones."""
+    svg = b'''
+      <svg xmlns="http://www.w3.org/2000/svg"
+           xmlns:xlink="http://www.w3.org/1999/xlink" width="20" height="20">
+        <defs>
+          <rect id="square" width="4" height="4" fill="blue" />
+          <mask id="mask"><rect width="10" height="20" fill="white" /></mask>
+          <pattern id="pattern" width="2" height="2"
+                   patternUnits="userSpaceOnUse">
+            <rect width="1" height="1" fill="red" />
+          </pattern>
+        </defs>
+        <use xlink:href="#square" x="8" y="8" />
+        <rect width="20" height="6" fill="lime" mask="url(#mask)" />
+        <rect y="14" width="20" height="6" fill="url(#pattern)" />
+      </svg>
+    '''
+    first, second = convert_many(svg, outputs=[
+        {'format': 'png'}, {'format': 'png'}]).values()
+    assert png_pixels(first) == png_pixels(second) == png_pixels(svg2png(svg))